@@ -0,0 +1,29 @@
+import sys
+from array import array
+
+
+class CRC16:
+    def __init__(self):
+        self.crcTable = []
+        for i in range(0, 256):
+            crc = i << 8
+            for _ in range(0, 8):
+                crc = (crc << 1 ^ 0x8005 if crc & 0x8000 else crc << 1) \
+                    & 0xffff
+            self.crcTable.append(crc)
+        table = self.crcTable
+        self.wordTable = [(table[i >> 8] << 8 & 0xffff) ^
+                          table[table[i >> 8] >> 8 ^ i & 0xff]
+                          for i in range(0, 0x10000)]
+
+    def get_crc(self, data, crc=0):
+        words = array('H')
+        words.frombytes(data[:len(data) & ~1])
+        if sys.byteorder == 'little':
+            words.byteswap()
+        table = self.wordTable
+        for word in words:
+            crc = table[crc ^ word]
+        if len(data) & 1:
+            crc = (crc << 8 & 0xffff) ^ self.crcTable[crc >> 8 ^ data[-1]]
+        return crc
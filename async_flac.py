@@ -0,0 +1,62 @@
+import asyncio
+import io
+from flac import AudioFile
+
+read_chunk_size = 1 << 16
+
+
+class ExecutorReader:
+    def __init__(self, f, executor=None):
+        self.f = f
+        self.executor = executor
+
+    async def read(self, size):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.f.read, size)
+
+
+class MetadataStream(io.BytesIO):
+    def read(self, size=-1):
+        data = super().read(size)
+        if not data and size:
+            raise ValueError('only metadata was read asynchronously, '
+                             'open the file with AudioFile for frame access')
+        return data
+
+
+async def read_exactly(reader, size, chunk_size=read_chunk_size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = await reader.read(min(size - len(data), chunk_size))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+async def read_metadata(reader, chunk_size=read_chunk_size):
+    reads = AudioFile.metadata_reads()
+    size = next(reads)
+    try:
+        while True:
+            size = reads.send(await read_exactly(reader, size, chunk_size))
+    except StopIteration as stop:
+        return bytes(stop.value)
+
+
+async def open_flac(filename, reader=None, executor=None,
+                    chunk_size=read_chunk_size, timeout=None, lazy=False):
+    f = None
+    if reader is None:
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(executor, open, filename, 'rb')
+        reader = ExecutorReader(f, executor)
+    try:
+        data = await asyncio.wait_for(read_metadata(reader, chunk_size),
+                                      timeout)
+    finally:
+        if f is not None:
+            f.close()
+    stream = MetadataStream(data)
+    stream.name = filename
+    return AudioFile(stream, lazy=lazy)
@@ -0,0 +1,191 @@
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from CRC8 import CRC8
+from flac import AudioFile
+from synthetic import make_encoded_file, make_file
+crc8 = CRC8()
+megabyte = 1 << 20
+
+corpus = {
+    'short fixed': {'frames': 10},
+    'long fixed': {'frames': 600},
+    'variable blocking': {'frames': 300, 'variable': True},
+    'many pictures': {'frames': 10, 'pictures': 200},
+    'huge picture': {'frames': 10, 'pictures': 1,
+                     'picture size': 8 * megabyte},
+    'big seektable': {'frames': 100, 'seekpoints': 10000},
+    'cuesheet': {'frames': 100, 'tracks': 99},
+    'rate 11 kHz': {'frames': 50, 'rate': 11000},
+    'rate 22051 Hz': {'frames': 50, 'rate': 22051},
+    'rate 100010 Hz': {'frames': 50, 'rate': 100010},
+    'lpc encoded': {'frames': 20, 'encoded': True},
+}
+
+
+def make_corpus(directory, names=None):
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for seed, (name, spec) in enumerate(sorted(corpus.items())):
+        if names and name not in names:
+            continue
+        options = {key.replace(' ', '_'): value
+                   for key, value in spec.items()}
+        path = os.path.join(directory, name.replace(' ', '_') + '.flac')
+        if not os.path.exists(path):
+            if options.pop('encoded', False):
+                make_encoded_file(path, seed=seed, **options)
+            else:
+                make_file(path, seed=seed, **options)
+        paths[name] = path
+    return paths
+
+
+def best_time(function, repeat):
+    best = float('inf')
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure(function, repeat, size=None, frames=None, count=None):
+    seconds = best_time(function, repeat)
+    result = {'seconds': seconds}
+    if size is not None:
+        result['MB/s'] = size / megabyte / seconds
+    if frames is not None:
+        result['frames/s'] = frames / seconds
+    if count is not None:
+        result['ops/s'] = count / seconds
+    return result
+
+
+def bench_headers(audio_file, repeat=5):
+    offsets = list(audio_file.frames.offsets)
+
+    def parse():
+        for i, offset in enumerate(offsets):
+            audio_file.parse_one_frame(audio_file.buffer, offset, i)
+    return measure(parse, repeat, frames=len(offsets))
+
+
+def bench_file(filename, repeat=5, decode=True):
+    results = {}
+    size = os.path.getsize(filename)
+    results['open'] = measure(lambda: AudioFile(filename, lazy=True).close(),
+                              repeat, count=1)
+    audio_file = AudioFile(filename, lazy=True)
+    parsers = [('streaminfo', audio_file.parse_streaminfo)]
+    for block, parser in (('vorbis comment', audio_file.parse_vorbis_comment),
+                          ('seektable', audio_file.parse_seektable),
+                          ('cuesheet', audio_file.parse_cuesheet)):
+        if block in audio_file.positions:
+            parsers.append((block, parser))
+    for name, parser in parsers:
+        begin, end = audio_file.positions[name]
+        results[name] = measure(parser, repeat, size=end - begin, count=1)
+    if 'picture' in audio_file.positions:
+        positions = audio_file.positions['picture']
+        results['picture'] = measure(
+            lambda: [audio_file.parse_picture(i)['pic']
+                     for i in range(0, len(positions))],
+            repeat, size=sum(end - begin for begin, end in positions),
+            count=len(positions))
+    audio_size = size - audio_file.first_frame
+    results['parse frames'] = measure(audio_file.parse_frames, repeat,
+                                      size=audio_size)
+    frames = len(audio_file.frames)
+    results['parse frames']['frames/s'] = \
+        frames / results['parse frames']['seconds']
+    results['frame headers'] = bench_headers(audio_file, repeat)
+    offsets = list(audio_file.frames.offsets)
+    ends = [audio_file.parse_one_frame(audio_file.buffer, offset, -1)[4]
+            for offset in offsets]
+    results['crc8 headers'] = measure(
+        lambda: [crc8.get_crc(audio_file.buffer[offset:end - 1])
+                 for offset, end in zip(offsets, ends)],
+        repeat, frames=frames)
+    results['crc8 bytes'] = measure(
+        lambda: crc8.get_crc(audio_file.buffer[audio_file.first_frame:]), 1,
+        size=audio_size)
+    if decode:
+        results['decode'] = measure(audio_file.decode, 1, size=audio_size,
+                                    frames=frames)
+    audio_file.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, benchmarks in results.items():
+        for benchmark, metrics in benchmarks.items():
+            old = baseline.get(name, {}).get(benchmark, {})
+            for metric, value in metrics.items():
+                if metric == 'seconds' or metric not in old:
+                    continue
+                if value < old[metric] * (1 - tolerance):
+                    regressions.append({'file': name,
+                                        'benchmark': benchmark,
+                                        'metric': metric,
+                                        'baseline': old[metric],
+                                        'current': value})
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description='flac parser benchmarks')
+    parser.add_argument('filenames', nargs='*', metavar='FILE',
+                        help='flac files to benchmark, '
+                             'the synthetic corpus by default')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='best of REPEAT runs is reported')
+    parser.add_argument('-c', '--corpus', metavar='DIRECTORY',
+                        help='where the synthetic corpus is generated')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write results as JSON')
+    parser.add_argument('-b', '--baseline', metavar='FILE',
+                        help='compare against saved results')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='allowed slowdown before a regression is flagged')
+    parser.add_argument('--no-decode', action='store_true',
+                        help='skip decoding benchmarks')
+    args = parser.parse_args()
+    if args.filenames:
+        files = {filename: filename for filename in args.filenames}
+    else:
+        directory = args.corpus or os.path.join(tempfile.gettempdir(),
+                                                'flacDecoder-corpus')
+        files = make_corpus(directory)
+    results = {}
+    for name, filename in files.items():
+        results[name] = bench_file(filename, args.repeat,
+                                   not args.no_decode)
+        sys.stderr.write('{0}: {1:.1f} MB/s parse frames\n'.format(
+            name, results[name]['parse frames']['MB/s']))
+    report = {'python': platform.python_version(), 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        report['regressions'] = compare(results, baseline, args.tolerance)
+        for regression in report['regressions']:
+            sys.stderr.write(
+                'regression: {file} {benchmark} {metric} '
+                '{baseline:.1f} -> {current:.1f}\n'.format(**regression))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+import mmap
+import os
+from urllib.request import Request, urlopen
+
+
+class ByteSource:
+    name = None
+    size = None
+
+    def __init__(self):
+        self.reads = 0
+        self.bytes_read = 0
+
+    def read_at(self, offset, size):
+        if self.size is not None:
+            size = max(0, min(size, self.size - offset))
+        data = self.fetch(offset, size) if size else b''
+        self.reads += 1
+        self.bytes_read += len(data)
+        return data
+
+    def fetch(self, offset, size):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FileSource(ByteSource):
+    def __init__(self, filename):
+        super().__init__()
+        self.name = filename
+        self.f = open(filename, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+
+    def fetch(self, offset, size):
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def close(self):
+        self.f.close()
+
+
+class MmapSource(ByteSource):
+    def __init__(self, filename):
+        super().__init__()
+        self.name = filename
+        with open(filename, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if self.size else None
+
+    def fetch(self, offset, size):
+        return self.mapping[offset:offset + size]
+
+    def view(self):
+        return memoryview(self.mapping if self.mapping is not None else b'')
+
+    def close(self):
+        if self.mapping is not None:
+            self.mapping.close()
+
+
+class BytesSource(ByteSource):
+    def __init__(self, data, name=None):
+        super().__init__()
+        self.name = name
+        if hasattr(data, 'getbuffer'):
+            data = data.getbuffer()
+        self.data = memoryview(data)
+        self.size = len(self.data)
+
+    def fetch(self, offset, size):
+        return bytes(self.data[offset:offset + size])
+
+    def view(self):
+        return self.data
+
+
+class RangeSource(ByteSource):
+    def __init__(self, fetch_range, size=None, name=None,
+                 block_size=1 << 16, cache_blocks=16):
+        super().__init__()
+        self.fetch_range = fetch_range
+        self.size = size
+        self.name = name
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.blocks = OrderedDict()
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def block(self, i):
+        if i in self.blocks:
+            self.blocks.move_to_end(i)
+            return self.blocks[i]
+        data = self.fetch_range(i * self.block_size, self.block_size)
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        self.blocks[i] = data
+        if len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)
+        return data
+
+    def fetch(self, offset, size):
+        data = bytearray()
+        end = offset + size
+        while offset < end:
+            i, skip = divmod(offset, self.block_size)
+            block = self.block(i)[skip:skip + end - offset]
+            if not block:
+                break
+            data += block
+            offset += len(block)
+        return bytes(data)
+
+
+class LocalRangeServer:
+    def __init__(self, filename):
+        self.filename = filename
+        self.size = os.path.getsize(filename)
+
+    def __call__(self, offset, size):
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+
+class HttpRangeServer:
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, offset, size):
+        request = Request(self.url, headers={
+            'Range': 'bytes={0}-{1}'.format(offset, offset + size - 1)})
+        with urlopen(request, timeout=self.timeout) as response:
+            if response.status != 206:
+                raise ValueError('server does not support range requests')
+            return response.read()
+
+
+class SourceStream:
+    def __init__(self, source, offset=0):
+        self.source = source
+        self.name = source.name
+        self.offset = offset
+
+    def read(self, size):
+        data = self.source.read_at(self.offset, size)
+        self.offset += len(data)
+        return data
@@ -0,0 +1,240 @@
+from argparse import ArgumentParser
+import os
+import sqlite3
+import sys
+import time
+from scanner import find_files, iter_scan
+
+
+schema = """
+create table if not exists files (
+    id integer primary key,
+    path text unique not null,
+    size integer not null,
+    mtime real not null,
+    rate integer,
+    channels integer,
+    bits_per_sample integer,
+    samples integer,
+    block_minsize integer,
+    block_maxsize integer,
+    frame_minsize integer,
+    frame_maxsize integer,
+    md5 text,
+    vendor text
+);
+create table if not exists tags (
+    file_id integer not null references files(id) on delete cascade,
+    name text not null,
+    value text not null
+);
+create table if not exists tracks (
+    file_id integer not null references files(id) on delete cascade,
+    number integer not null,
+    offset integer not null,
+    isrc text,
+    is_audio integer,
+    pre_emphasis integer,
+    indexes integer
+);
+create table if not exists pictures (
+    file_id integer not null references files(id) on delete cascade,
+    type text,
+    mime_type text,
+    description text,
+    width integer,
+    height integer,
+    color_depth integer,
+    colors integer,
+    length integer
+);
+create table if not exists errors (
+    path text primary key,
+    size integer,
+    mtime real,
+    error text,
+    message text
+);
+create index if not exists tags_name_value on tags(name, value);
+create index if not exists tags_file on tags(file_id);
+create index if not exists tracks_file on tracks(file_id);
+create index if not exists pictures_file on pictures(file_id);
+create index if not exists files_format
+    on files(rate, channels, bits_per_sample);
+"""
+
+properties = ('rate', 'channels', 'bits_per_sample')
+
+
+class Catalog:
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('pragma foreign_keys = on')
+        self.connection.execute('pragma journal_mode = wal')
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def known(self):
+        rows = self.connection.execute(
+            'select path, size, mtime from files '
+            'union all select path, size, mtime from errors')
+        return {row['path']: (row['size'], row['mtime']) for row in rows}
+
+    def update(self, paths, jobs=None, processes=False,
+               extensions=('.flac',)):
+        known = self.known()
+        seen = set()
+        changed = []
+        for path in find_files(paths, extensions):
+            path = os.path.abspath(path)
+            seen.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) != (stat.st_size, stat.st_mtime):
+                changed.append(path)
+        roots = [os.path.abspath(path) for path in paths]
+        deleted = [path for path in known if path not in seen and
+                   any(path == root or
+                       path.startswith(root.rstrip(os.sep) + os.sep)
+                       for root in roots)]
+        stats = {'added': 0, 'errors': 0, 'deleted': len(deleted),
+                 'unchanged': len(seen) - len(changed)}
+        with self.connection:
+            self.remove(deleted)
+            self.remove(changed)
+            for record, error in iter_scan(changed, jobs, processes):
+                if error:
+                    stats['errors'] += 1
+                    self.connection.execute(
+                        'insert into errors values (?, ?, ?, ?, ?)',
+                        (error['path'], error['size'], error['mtime'],
+                         error['error'], error['message']))
+                else:
+                    stats['added'] += 1
+                    self.insert(record)
+        return stats
+
+    def remove(self, paths):
+        rows = [(path,) for path in paths]
+        self.connection.executemany('delete from files where path = ?', rows)
+        self.connection.executemany('delete from errors where path = ?', rows)
+
+    def insert(self, record):
+        info = record['streaminfo']
+        file_id = self.connection.execute(
+            'insert into files values '
+            '(null, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (record['path'], record['size'], record['mtime'], info['rate'],
+             info['channels'], info['bits per sample'],
+             info['samples in flow'], info['block_minsize'],
+             info['block_maxsize'], info['frame_minsize'],
+             info['frame_maxsize'], record['md5'],
+             record['vendor'])).lastrowid
+        self.connection.executemany(
+            'insert into tags values (?, ?, ?)',
+            [(file_id, name.upper(), value)
+             for name, values in record['tags'].items() for value in values])
+        self.connection.executemany(
+            'insert into tracks values (?, ?, ?, ?, ?, ?, ?)',
+            [(file_id, track['track number'], track['offset'],
+              track['isrc'].rstrip('\x00') or None, track['is audio'],
+              track['pre-emphasis'], len(track['track index']))
+             for track in (record['cuesheet'] or {}).get('tracks', [])])
+        self.connection.executemany(
+            'insert into pictures values (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(file_id, picture['picture type'], picture['mime type'],
+              picture['description'], picture['width'], picture['height'],
+              picture['color depth'], picture['number of colors'],
+              picture['length'])
+             for picture in record['pictures']])
+
+    def query(self, tags=None, **audio):
+        conditions = []
+        parameters = []
+        for name, value in (tags or {}).items():
+            conditions.append('id in (select file_id from tags '
+                              'where name = ? and value = ?)')
+            parameters += [name.upper(), value]
+        for name, value in audio.items():
+            if name not in properties:
+                raise ValueError('unknown property: ' + name)
+            if value is not None:
+                conditions.append(name + ' = ?')
+                parameters.append(value)
+        sql = 'select * from files'
+        if conditions:
+            sql += ' where ' + ' and '.join(conditions)
+        rows = self.connection.execute(sql + ' order by path', parameters)
+        return [dict(row) for row in rows]
+
+    def tags(self, path):
+        rows = self.connection.execute(
+            'select name, value from tags join files on files.id = file_id '
+            'where path = ?', (os.path.abspath(path),))
+        tags = {}
+        for row in rows:
+            tags.setdefault(row['name'], set()).add(row['value'])
+        return tags
+
+    def errors(self):
+        rows = self.connection.execute('select * from errors order by path')
+        return [dict(row) for row in rows]
+
+
+def parse_tag(text):
+    if '=' not in text:
+        raise ValueError('tag must look like NAME=VALUE')
+    return text.split('=', 1)
+
+
+def main():
+    parser = ArgumentParser(description='flac library catalog',
+                            usage="""python catalog.py update [paths]
+       python catalog.py query [--tag NAME=VALUE] [--rate RATE]
+        use flag -d --database to choose the catalog file""")
+    parser.add_argument('-d', '--database', default='catalog.db',
+                        help='SQLite catalog file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    update = commands.add_parser('update', help='Rescan changed files')
+    update.add_argument('paths', nargs='+', metavar='PATH')
+    update.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of concurrent workers')
+    update.add_argument('-p', '--processes', action='store_true',
+                        help='Use a process pool')
+    query = commands.add_parser('query', help='Find files')
+    query.add_argument('-t', '--tag', action='append', default=[],
+                       type=parse_tag, metavar='NAME=VALUE')
+    query.add_argument('-r', '--rate', type=int)
+    query.add_argument('-c', '--channels', type=int)
+    query.add_argument('-b', '--bits', type=int)
+    args = parser.parse_args()
+    with Catalog(args.database) as catalog:
+        start = time.perf_counter()
+        if args.command == 'update':
+            stats = catalog.update(args.paths, args.jobs, args.processes)
+            stats['seconds'] = round(time.perf_counter() - start, 3)
+            print(', '.join('{0}: {1}'.format(key, value)
+                            for key, value in stats.items()))
+        else:
+            rows = catalog.query(dict(args.tag), rate=args.rate,
+                                 channels=args.channels,
+                                 bits_per_sample=args.bits)
+            for row in rows:
+                print(row['path'])
+            sys.stderr.write('{0} files in {1:.1f} ms\n'.format(
+                len(rows), (time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -23,8 +23,13 @@ picture_descr = {0: 'other',
 channels = {8: 'left/side stereo', 9: 'right/side stereo',
             10: 'mid/side stereo'}
 
+channel_codes = {name: code for code, name in channels.items()}
+
 sample_size = {1: 8, 2: 12, 4: 16, 5: 20, 6: 24}
 
+block_size = {1: 192, 2: 576, 3: 1152, 4: 2304, 5: 4608, 8: 256, 9: 512,
+              10: 1024, 11: 2048, 12: 4096, 13: 8192, 14: 16384, 15: 32768}
+
 sample_rate = {1: 88.2, 2: 176.4, 3: 192, 4: 8, 5: 16, 6: 22.05, 7: 24, 8: 32,
                9: 44.1, 10: 48, 11: 96}
 
@@ -60,3 +65,18 @@ cuesheet_text = '''\nCUESHEET:
             Lead-in samples: {1}
             Corresponds to CD: {2}'''
 track_text = '{0}. Offset: {1}, ISRC: {2}, Track type: {3}, pre-emphasis: {4}'
+verify_text = '''VERIFY:
+        frames: {0}
+        samples: {1} of {2}
+        frames failing CRC-16: {3}
+        frames failing to decode: {4}
+        MD5 signature: {5}'''
+
+md5_text = {True: 'ok', False: 'MISMATCH', None: 'not set'}
+
+playback_text = '''PLAYBACK:
+        start-up latency: {0:.1f} ms
+        last seek latency: {1}
+        underruns: {2}
+        frames decoded: {3}
+        frames failing to decode: {4}'''
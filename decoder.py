@@ -0,0 +1,206 @@
+from array import array
+from itertools import accumulate, chain, islice
+from operator import add, mul, sub
+import re
+import sys
+import constants
+rice_codes = {}
+rice_partitions = {}
+
+
+def rice_patterns(parameter, count):
+    if parameter not in rice_codes:
+        rice_codes[parameter] = re.compile('0*1[01]{%d}' % parameter)
+    if (parameter, count) not in rice_partitions:
+        rice_partitions[parameter, count] = \
+            re.compile('(?:0*1[01]{%d}){%d}' % (parameter, count))
+    return rice_codes[parameter], rice_partitions[parameter, count]
+
+
+class BitReader:
+    def __init__(self, data):
+        self.bits = bin(int.from_bytes(data, byteorder='big') |
+                        1 << 8 * len(data))[3:]
+        self.pos = 0
+
+    def read(self, n):
+        if n == 0:
+            return 0
+        value = self.bits[self.pos:self.pos + n]
+        if len(value) != n:
+            raise ValueError('unexpected end of frame')
+        self.pos += n
+        return int(value, 2)
+
+    def read_signed(self, n):
+        value = self.read(n)
+        if n and value >> (n - 1):
+            value -= 1 << n
+        return value
+
+    def read_unary(self):
+        end = self.bits.find('1', self.pos)
+        if end < 0:
+            raise ValueError('unexpected end of frame')
+        count = end - self.pos
+        self.pos = end + 1
+        return count
+
+    def read_signed_block(self, n, count):
+        if n == 0:
+            return [0] * count
+        bits, pos = self.bits, self.pos
+        if len(bits) < pos + n * count:
+            raise ValueError('unexpected end of frame')
+        self.pos += n * count
+        sign, full = 1 << (n - 1), 1 << n
+        values = [int(bits[i:i + n], 2)
+                  for i in range(pos, pos + n * count, n)]
+        return [value - full if value >= sign else value for value in values]
+
+    def align(self):
+        self.pos += -self.pos % 8
+
+
+def read_residual(reader, block_size, order):
+    method = reader.read(2)
+    if method > 1:
+        raise ValueError('reserved residual coding method')
+    parameter_len = 4 if method == 0 else 5
+    escape = (1 << parameter_len) - 1
+    partition_order = reader.read(4)
+    partition_size = block_size >> partition_order
+    if partition_size << partition_order != block_size or \
+            partition_size < order:
+        raise ValueError('invalid residual partition order')
+    residual = []
+    bits = reader.bits
+    for partition in range(0, 1 << partition_order):
+        count = partition_size - order if partition == 0 else partition_size
+        parameter = reader.read(parameter_len)
+        if parameter == escape:
+            residual.extend(reader.read_signed_block(reader.read(5), count))
+            continue
+        codes, partition_codes = rice_patterns(parameter, count)
+        match = partition_codes.match(bits, reader.pos)
+        if not match:
+            raise ValueError('unexpected end of frame')
+        width, top = parameter + 1, 1 << parameter
+        values = [(len(code) - width << parameter) + int(code, 2) - top
+                  for code in codes.findall(bits, reader.pos, match.end())]
+        residual.extend([value >> 1 ^ -(value & 1) for value in values])
+        reader.pos = match.end()
+    return residual
+
+
+def restore_fixed(warmup, residual):
+    differences = [warmup]
+    for i in range(0, len(warmup)):
+        differences.append(list(map(sub, differences[i][1:],
+                                    differences[i][:-1])))
+    samples = residual
+    for level in reversed(differences[:-1]):
+        samples = islice(accumulate(chain(level[-1:], samples)), 1, None)
+    return warmup + list(samples)
+
+
+def restore_lpc(warmup, residual, coefficients, shift):
+    order = len(coefficients)
+    coefficients = coefficients[::-1]
+    samples = list(warmup)
+    append = samples.append
+    i = 0
+    for value in residual:
+        append(value + (sum(map(mul, coefficients, samples[i:i + order]))
+                        >> shift))
+        i += 1
+    return samples
+
+
+def decode_subframe(reader, block_size, sample_size):
+    if reader.read(1):
+        raise ValueError('invalid subframe padding')
+    kind = reader.read(6)
+    wasted = 0
+    if reader.read(1):
+        wasted = reader.read_unary() + 1
+        sample_size -= wasted
+    if kind == 0:
+        samples = [reader.read_signed(sample_size)] * block_size
+    elif kind == 1:
+        samples = reader.read_signed_block(sample_size, block_size)
+    elif 8 <= kind <= 12:
+        order = kind - 8
+        if order > block_size:
+            raise ValueError('fixed predictor order exceeds block size')
+        warmup = reader.read_signed_block(sample_size, order)
+        samples = restore_fixed(warmup,
+                                read_residual(reader, block_size, order))
+    elif kind >= 32:
+        order = kind - 31
+        if order > block_size:
+            raise ValueError('lpc order exceeds block size')
+        warmup = reader.read_signed_block(sample_size, order)
+        precision = reader.read(4) + 1
+        if precision == 16:
+            raise ValueError('invalid lpc coefficient precision')
+        shift = reader.read_signed(5)
+        if shift < 0:
+            raise ValueError('negative lpc shift')
+        coefficients = reader.read_signed_block(precision, order)
+        samples = restore_lpc(warmup,
+                              read_residual(reader, block_size, order),
+                              coefficients, shift)
+    else:
+        raise ValueError('reserved subframe type')
+    if wasted:
+        samples = [sample << wasted for sample in samples]
+    return samples
+
+
+def decode_frame(buffer, pos, end, block_size, channels, sample_size):
+    reader = BitReader(buffer[pos:end])
+    if isinstance(channels, str):
+        assignment = constants.channel_codes[channels]
+        if assignment == 9:
+            sizes = [sample_size + 1, sample_size]
+        else:
+            sizes = [sample_size, sample_size + 1]
+    else:
+        assignment = channels - 1
+        sizes = [sample_size] * channels
+    subframes = [decode_subframe(reader, block_size, size) for size in sizes]
+    if assignment == 8:
+        left, side = subframes
+        subframes = [left, list(map(sub, left, side))]
+    elif assignment == 9:
+        side, right = subframes
+        subframes = [list(map(add, side, right)), right]
+    elif assignment == 10:
+        mid, side = subframes
+        mid = [m << 1 | s & 1 for m, s in zip(mid, side)]
+        subframes = [[m + s >> 1 for m, s in zip(mid, side)],
+                     [m - s >> 1 for m, s in zip(mid, side)]]
+    reader.align()
+    end_pos = pos + reader.pos // 8 + 2
+    if end_pos > end:
+        raise ValueError('unexpected end of frame')
+    return [array('i', samples) for samples in subframes], end_pos
+
+
+def to_bytes(channels, sample_size):
+    width = (sample_size + 7) // 8
+    interleaved = array('i', bytes(4 * len(channels) * len(channels[0])))
+    for i, channel in enumerate(channels):
+        interleaved[i::len(channels)] = channel
+    if width == 1:
+        interleaved = array('b', interleaved)
+    elif width == 2:
+        interleaved = array('h', interleaved)
+    if sys.byteorder == 'big':
+        interleaved.byteswap()
+    data = interleaved.tobytes()
+    if width == 3:
+        data = bytearray(data)
+        del data[3::4]
+    return data
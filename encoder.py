@@ -0,0 +1,468 @@
+from argparse import ArgumentParser
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import math
+from operator import mul, sub
+import wave
+import constants
+import decoder
+from CRC8 import CRC8
+from CRC16 import CRC16
+from flac import AudioFile
+crc8 = CRC8()
+crc16 = CRC16()
+vendor = 'flacDecoder'
+rate_codes = {88200: 1, 176400: 2, 192000: 3, 8000: 4, 16000: 5, 22050: 6,
+              24000: 7, 32000: 8, 44100: 9, 48000: 10, 96000: 11}
+block_size_codes = {size: code for code, size in constants.block_size.items()}
+sample_size_codes = {size: code
+                     for code, size in constants.sample_size.items()}
+picture_codes = {name: code for code, name in constants.picture_descr.items()}
+max_partition_order = 8
+frames_per_job = 16
+
+
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def write(self, value, n):
+        if n:
+            self.bits.append(format(value & (1 << n) - 1, '0%db' % n))
+
+    def write_block(self, values, n):
+        if n:
+            mask, pattern = (1 << n) - 1, '0%db' % n
+            self.bits.append(''.join([format(value & mask, pattern)
+                                      for value in values]))
+
+    def extend(self, bits):
+        self.bits.append(bits)
+
+    def tobytes(self):
+        bits = ''.join(self.bits)
+        bits += '0' * (-len(bits) % 8)
+        return int('1' + bits, 2).to_bytes(len(bits) // 8 + 1,
+                                           byteorder='big')[1:]
+
+
+def metadata_block(type_of_block, data, is_last=False):
+    return bytes([is_last << 7 | type_of_block]) + \
+        len(data).to_bytes(3, byteorder='big') + data
+
+
+def utf8_number(number):
+    if number < 0x80:
+        return bytes([number])
+    length = 2
+    while number >= 1 << (5 * length + 1):
+        length += 1
+    data = []
+    for _ in range(0, length - 1):
+        data.append(0x80 | number & 0x3f)
+        number >>= 6
+    data.append(0xff << (8 - length) & 0xff | number)
+    return bytes(reversed(data))
+
+
+def rate_code(rate):
+    if rate in rate_codes:
+        return rate_codes[rate], b''
+    if rate % 1000 == 0 and rate // 1000 < 256:
+        return 12, bytes([rate // 1000])
+    if rate < 0x10000:
+        return 13, rate.to_bytes(2, byteorder='big')
+    if rate % 10 == 0 and rate // 10 < 0x10000:
+        return 14, (rate // 10).to_bytes(2, byteorder='big')
+    return 0, b''
+
+
+def block_size_code(block_size):
+    if block_size in block_size_codes:
+        return block_size_codes[block_size], b''
+    if block_size <= 256:
+        return 6, bytes([block_size - 1])
+    return 7, (block_size - 1).to_bytes(2, byteorder='big')
+
+
+def frame_header(number, block_size, rate, assignment, sample_size,
+                 variable=False):
+    size_code, size_data = block_size_code(block_size)
+    code, rate_data = rate_code(rate)
+    header = bytes([0xff, 0xf8 | variable, size_code << 4 | code,
+                    assignment << 4 |
+                    sample_size_codes.get(sample_size, 0) << 1]) + \
+        utf8_number(number) + size_data + rate_data
+    return header + bytes([crc8.get_crc(header)])
+
+
+def fold(residual):
+    return [value << 1 ^ value >> 63 for value in residual]
+
+
+def rice_partitions(folded, block_size, order):
+    orders = []
+    for partition_order in range(0, max_partition_order + 1):
+        size = block_size >> partition_order
+        if size << partition_order != block_size or size < order or not size:
+            break
+        orders.append(partition_order)
+    size = block_size >> orders[-1]
+    counts = [size] * (1 << orders[-1])
+    counts[0] -= order
+    sums, pos = [], 0
+    for count in counts:
+        sums.append(sum(folded[pos:pos + count]))
+        pos += count
+    best = None
+    for partition_order in reversed(orders):
+        parameters = [rice_parameter(total, count)
+                      for total, count in zip(sums, counts)]
+        bits = sum(count * (parameter + 1) + (total >> parameter)
+                   for total, count, parameter
+                   in zip(sums, counts, parameters))
+        bits += len(parameters) * 5 if max(parameters) > 14 \
+            else len(parameters) * 4
+        if best is None or bits < best[0]:
+            best = bits, partition_order, parameters, counts
+        sums = [sum(sums[i:i + 2]) for i in range(0, len(sums), 2)]
+        counts = [sum(counts[i:i + 2]) for i in range(0, len(counts), 2)]
+    return best
+
+
+def rice_parameter(total, count):
+    if not count or total < count:
+        return 0
+    return min(30, int(math.log2(total / count)))
+
+
+def write_residual(writer, folded, partition_order, parameters, counts):
+    method = 1 if max(parameters) > 14 else 0
+    writer.write(method, 2)
+    writer.write(partition_order, 4)
+    pos = 0
+    for parameter, count in zip(parameters, counts):
+        writer.write(parameter, 5 if method else 4)
+        mask, top = (1 << parameter) - 1, 1 << parameter
+        writer.extend(''.join(['0' * (value >> parameter) +
+                               format(value & mask | top, 'b')
+                               for value in folded[pos:pos + count]]))
+        pos += count
+
+
+def fixed_residual(samples, order):
+    for _ in range(0, order):
+        samples = list(map(sub, samples[1:], samples[:-1]))
+    return samples
+
+
+def lpc_coefficients(samples, order):
+    n = len(samples)
+    window = [1 - ((2 * i - n + 1) / (n + 1)) ** 2 for i in range(0, n)]
+    windowed = list(map(mul, samples, window))
+    correlation = [sum(map(mul, windowed, windowed[lag:]))
+                   for lag in range(0, order + 1)]
+    if correlation[0] == 0:
+        return []
+    coefficients, error = [], correlation[0]
+    for i in range(0, order):
+        reflection = (correlation[i + 1] -
+                      sum(map(mul, coefficients,
+                              reversed(correlation[1:i + 1])))) / error
+        coefficients = [c - reflection * coefficients[i - 1 - j]
+                        for j, c in enumerate(coefficients)] + [reflection]
+        error *= 1 - reflection * reflection
+        if error <= 0:
+            break
+    return coefficients
+
+
+def quantize(coefficients, precision):
+    largest = max(abs(c) for c in coefficients)
+    if largest == 0:
+        return None
+    shift = min(15, precision - 1 - math.frexp(largest)[1])
+    if shift < 0:
+        return None
+    limit = 1 << (precision - 1)
+    quantized, error = [], 0.0
+    for c in coefficients:
+        error += c * (1 << shift)
+        value = max(-limit, min(limit - 1, round(error)))
+        quantized.append(value)
+        error -= value
+    return quantized, shift
+
+
+def lpc_residual(samples, quantized, shift):
+    order = len(quantized)
+    reversed_coefficients = quantized[::-1]
+    return [samples[i] - (sum(map(mul, reversed_coefficients,
+                                  samples[i - order:i])) >> shift)
+            for i in range(order, len(samples))]
+
+
+def encode_subframe(writer, samples, sample_size, max_lpc_order, precision):
+    block_size = len(samples)
+    if samples.count(samples[0]) == block_size:
+        writer.write(0, 8)
+        writer.write(samples[0], sample_size)
+        return
+    candidates = []
+    residuals = [samples]
+    for order in range(1, min(4, block_size - 1) + 1):
+        residuals.append(list(map(sub, residuals[-1][1:],
+                                  residuals[-1][:-1])))
+    order = min(range(0, len(residuals)),
+                key=lambda i: sum(map(abs, residuals[i])))
+    folded = fold(residuals[order])
+    best = rice_partitions(folded, block_size, order)
+    candidates.append((best[0] + order * sample_size, 8 + order, order,
+                       None, folded, best))
+    lpc_order = min(max_lpc_order, block_size - 1)
+    if lpc_order > 0:
+        coefficients = lpc_coefficients(samples, lpc_order)
+        quantization = quantize(coefficients, precision) \
+            if coefficients else None
+        if quantization:
+            quantized, shift = quantization
+            lpc_order = len(quantized)
+            folded = fold(lpc_residual(samples, quantized, shift))
+            best = rice_partitions(folded, block_size, lpc_order)
+            candidates.append((best[0] + lpc_order * (sample_size + precision)
+                               + 9, 31 + lpc_order, lpc_order,
+                               (quantized, shift), folded, best))
+    bits, kind, order, lpc, folded, best = min(candidates,
+                                               key=lambda c: c[0])
+    if bits >= block_size * sample_size:
+        writer.write(2, 8)
+        writer.write_block(samples, sample_size)
+        return
+    writer.write(kind << 1, 8)
+    writer.write_block(samples[:order], sample_size)
+    if lpc:
+        quantized, shift = lpc
+        writer.write(precision - 1, 4)
+        writer.write(shift, 5)
+        writer.write_block(quantized, precision)
+    write_residual(writer, folded, *best[1:])
+
+
+def stereo_assignment(left, right):
+    side = list(map(sub, left, right))
+    mid = [a + b >> 1 for a, b in zip(left, right)]
+
+    def cost(samples):
+        return sum(map(abs, fixed_residual(samples, 2)))
+    left_cost, right_cost, side_cost, mid_cost = \
+        cost(left), cost(right), cost(side), cost(mid)
+    return min((left_cost + right_cost, 1, [left, right], [0, 0]),
+               (left_cost + side_cost, 8, [left, side], [0, 1]),
+               (side_cost + right_cost, 9, [side, right], [1, 0]),
+               (mid_cost + side_cost, 10, [mid, side], [0, 1]),
+               key=lambda option: option[0])[1:]
+
+
+def encode_frame(number, channels, sample_rate, sample_size,
+                 max_lpc_order=8, precision=12):
+    block_size = len(channels[0])
+    channels = [list(channel) for channel in channels]
+    if len(channels) == 2:
+        assignment, channels, extra = stereo_assignment(*channels)
+    else:
+        assignment, extra = len(channels) - 1, [0] * len(channels)
+    writer = BitWriter()
+    for samples, more in zip(channels, extra):
+        encode_subframe(writer, samples, sample_size + more, max_lpc_order,
+                        precision)
+    frame = frame_header(number, block_size, sample_rate, assignment,
+                         sample_size) + writer.tobytes()
+    return frame + crc16.get_crc(frame).to_bytes(2, byteorder='big')
+
+
+def encode_frames(job):
+    first, blocks, sample_rate, sample_size, max_lpc_order = job
+    return [encode_frame(first + i, channels, sample_rate, sample_size,
+                         max_lpc_order)
+            for i, channels in enumerate(blocks)]
+
+
+def streaminfo_block(block_size, frame_sizes, sample_rate, channels,
+                     sample_size, total, md5):
+    if total < block_size:
+        block_size = total
+    return block_size.to_bytes(2, byteorder='big') * 2 + \
+        min(frame_sizes, default=0).to_bytes(3, byteorder='big') + \
+        max(frame_sizes, default=0).to_bytes(3, byteorder='big') + \
+        (sample_rate << 44 | (channels - 1) << 41 | (sample_size - 1) << 36 |
+         total).to_bytes(8, byteorder='big') + md5
+
+
+def seek_frames(total, block_size, interval):
+    frames = []
+    for sample in range(0, total, interval):
+        frame = sample // block_size
+        if not frames or frames[-1] != frame:
+            frames.append(frame)
+    return frames
+
+
+def seektable_block(frames, offsets, block_size, total):
+    data = b''
+    for frame in frames:
+        offset = offsets[frame] if offsets else 0
+        data += (frame * block_size).to_bytes(8, byteorder='big') + \
+            offset.to_bytes(8, byteorder='big') + \
+            min(block_size, total - frame * block_size).to_bytes(
+                2, byteorder='big')
+    return data
+
+
+def vorbis_comment_block(tags):
+    comments = []
+    for name, values in (tags or {}).items():
+        if name == 'vendor':
+            continue
+        if isinstance(values, str):
+            values = [values]
+        for value in sorted(values):
+            comments.append('{0}={1}'.format(name, value).encode())
+    data = len(vendor).to_bytes(4, byteorder='little') + vendor.encode() + \
+        len(comments).to_bytes(4, byteorder='little')
+    for comment in comments:
+        data += len(comment).to_bytes(4, byteorder='little') + comment
+    return data
+
+
+def picture_block(picture):
+    picture_type = picture.get('picture type', 3)
+    if isinstance(picture_type, str):
+        picture_type = picture_codes[picture_type]
+    mime_type = picture['mime type'].encode()
+    description = picture.get('description', '').encode()
+    data = bytes(picture['pic'])
+    return picture_type.to_bytes(4, byteorder='big') + \
+        len(mime_type).to_bytes(4, byteorder='big') + mime_type + \
+        len(description).to_bytes(4, byteorder='big') + description + \
+        b''.join(picture.get(key, 0).to_bytes(4, byteorder='big')
+                 for key in ('width', 'height', 'color depth',
+                             'number of colors')) + \
+        len(data).to_bytes(4, byteorder='big') + data
+
+
+def encode(path, channels, sample_rate, sample_size, block_size=4096,
+           tags=None, pictures=(), padding=8192, seekpoint_interval=None,
+           max_lpc_order=8, workers=None):
+    if not 4 <= sample_size <= 24:
+        raise ValueError('unsupported sample size')
+    if not 1 <= len(channels) <= 8:
+        raise ValueError('unsupported number of channels')
+    total = len(channels[0])
+    if seekpoint_interval is None:
+        seekpoint_interval = 10 * sample_rate
+    points = seek_frames(total, block_size, seekpoint_interval)
+    blocks = [(0, bytes(34))]
+    if points:
+        blocks.append((3, seektable_block(points, None, block_size, total)))
+    blocks.append((4, vorbis_comment_block(tags)))
+    for picture in pictures:
+        blocks.append((6, picture_block(picture)))
+    if padding:
+        blocks.append((1, bytes(padding)))
+    jobs = []
+    md5 = hashlib.md5()
+    for first in range(0, total, block_size * frames_per_job):
+        job_blocks = []
+        for start in range(first, min(total, first +
+                                      block_size * frames_per_job),
+                           block_size):
+            frame = [array('i', channel[start:start + block_size])
+                     for channel in channels]
+            md5.update(decoder.to_bytes(frame, sample_size))
+            job_blocks.append(frame)
+        jobs.append((first // block_size, job_blocks, sample_rate,
+                     sample_size, max_lpc_order))
+    offsets, frame_sizes = [], []
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        for i, (type_of_block, data) in enumerate(blocks):
+            f.write(metadata_block(type_of_block, data,
+                                   i == len(blocks) - 1))
+        first_frame = f.tell()
+        if workers == 1:
+            results = map(encode_frames, jobs)
+        else:
+            executor = ProcessPoolExecutor(workers)
+            results = executor.map(encode_frames, jobs)
+        try:
+            for frames in results:
+                for frame in frames:
+                    offsets.append(f.tell() - first_frame)
+                    frame_sizes.append(len(frame))
+                    f.write(frame)
+        finally:
+            if workers != 1:
+                executor.shutdown()
+        f.seek(8)
+        f.write(streaminfo_block(block_size, frame_sizes, sample_rate,
+                                 len(channels), sample_size, total,
+                                 md5.digest()))
+        if points:
+            f.seek(8 + 34 + 4)
+            f.write(seektable_block(points, offsets, block_size, total))
+    return path
+
+
+def read_wav(filename):
+    with wave.open(filename, 'rb') as f:
+        width = f.getsampwidth()
+        channels = f.getnchannels()
+        rate = f.getframerate()
+        data = f.readframes(f.getnframes())
+    if width == 1:
+        samples = array('i', [byte - 128 for byte in data])
+    elif width == 2:
+        samples = array('i', array('h', data))
+    elif width == 3:
+        samples = array('i', [int.from_bytes(data[i:i + 3],
+                                             byteorder='little', signed=True)
+                              for i in range(0, len(data), 3)])
+    else:
+        raise ValueError('unsupported sample width')
+    return [samples[i::channels] for i in range(0, channels)], rate, width * 8
+
+
+def encode_file(source, path, **options):
+    if source.lower().endswith('.wav'):
+        channels, rate, sample_size = read_wav(source)
+        return encode(path, channels, rate, sample_size, **options)
+    with AudioFile(source) as audio_file:
+        options.setdefault('tags', audio_file.tags)
+        options.setdefault('pictures', audio_file.picture)
+        return encode(path, audio_file.decode(),
+                      audio_file.streaminfo['rate'],
+                      audio_file.streaminfo['bits per sample'], **options)
+
+
+def main():
+    parser = ArgumentParser(description='flac encoder',
+                            usage="""python encoder.py INPUT OUTPUT
+        INPUT is a PCM wav or a flac file to re-encode
+        use flag -b --block-size to set the number of samples per frame
+        use flag -l --lpc-order to limit the LPC order, 0 for fixed only
+        use flag -j --jobs to set the number of worker processes""")
+    parser.add_argument('input', metavar='INPUT')
+    parser.add_argument('output', metavar='OUTPUT')
+    parser.add_argument('-b', '--block-size', type=int, default=4096)
+    parser.add_argument('-l', '--lpc-order', type=int, default=8)
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('--padding', type=int, default=8192)
+    args = parser.parse_args()
+    encode_file(args.input, args.output, block_size=args.block_size,
+                max_lpc_order=args.lpc_order, workers=args.jobs,
+                padding=args.padding)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,56 +1,246 @@
+from array import array
+from bisect import bisect_right
+import hashlib
+import mmap
+import os
 import re
+from time import perf_counter
+from byte_source import SourceStream
 import constants
+import decoder
 from CRC8 import CRC8
+from CRC16 import CRC16
+from frame_index import FrameIndex
+from stats import Stats
+from picture import Picture
+import report
 crc8 = CRC8()
+crc16 = CRC16()
 ext_regex = re.compile('.+?/(.+)')
+sync_regex = re.compile(b'\xff[\xf8-\xfb]')
+placeholder_point = 0xffffffffffffffff
+max_header_size = 16
+scan_chunk_size = 1 << 20
+stream_access_error = 'random access is not possible on a stream, ' \
+    'open a file or a byte source instead'
+
+
+def utf8_header(byte):
+    ones = 0
+    while ones < 8 and byte << ones & 0x80:
+        ones += 1
+    if ones == 0:
+        return 1, 0x7f
+    if ones == 1 or ones == 8:
+        return 0, 0
+    return ones, 0xff >> (ones + 1)
+
+
+utf8_headers = [utf8_header(byte) for byte in range(0, 256)]
+
+
+def read_exactly(f, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = f.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class BufferWindow:
+    def __init__(self, buffer):
+        self.data = buffer
+        self.base = 0
+        self.eof = True
+
+    def more(self):
+        return False
+
+    def discard(self, pos):
+        pass
+
+
+class StreamWindow:
+    def __init__(self, f, data, base, chunk_size):
+        self.read = f.read
+        self.data = bytearray(data)
+        self.base = base
+        self.chunk_size = chunk_size
+        self.eof = False
+
+    def more(self):
+        chunk = self.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.data += chunk
+        return True
+
+    def discard(self, pos):
+        if pos > self.base:
+            del self.data[:pos - self.base]
+            self.base = pos
 
 
 class AudioFile:
-    def __init__(self, filename):
+    def __init__(self, filename, lazy=False, profile=False):
+        start = perf_counter()
         self.filename = filename
+        self.stats = None
+        self.__frame_crc = crc16.get_crc
+        if profile:
+            self.__instrument()
+        self.__stream = None
+        self.__mapping = None
+        self.__last_window = None
+        if hasattr(filename, 'read_at'):
+            self.filename = filename.name
+            self.buffer = self.__open_source(filename)
+        elif hasattr(filename, 'read'):
+            self.filename = getattr(filename, 'name', None)
+            self.buffer = self.__read_stream(filename)
+        else:
+            self.buffer = self.__open_buffer()
         self.file_is_flac()
-        self.frames = []
         self.positions = {}
         self.first_frame = self.parse_metadata()
         self.streaminfo = {}
         self.parse_streaminfo()
         self.blocking_strategy = self.__get_blocking_strategy()
-        self.tags = None
-        self.picture = []
-        self.cuesheet = {}
-        self.seektable = []
-        if 'vorbis comment' in self.positions:
-            self.tags = self.parse_vorbis_comment()
-        if 'picture' in self.positions:
-            for i in range(0, len(self.positions['picture'])):
-                self.picture.append(self.parse_picture(i))
-        if 'cuesheet' in self.positions:
-            self.cuesheet = self.parse_cuesheet()
-        if 'seektable' in self.positions:
-            self.seektable = self.parse_seektable()
+        self.__build_header_tables()
+        self.frames = self.__new_frame_index()
+        self.__blocks = {}
+        if not lazy:
+            for block in ('tags', 'picture', 'cuesheet', 'seektable'):
+                getattr(self, block)
+        if profile:
+            self.stats.add('open', perf_counter() - start, self.first_frame)
 
-    def file_is_flac(self):
+    def __instrument(self):
+        self.stats = Stats()
+        timed = self.stats.timed
+        self.__read = timed('read', self.__read,
+                            lambda args, result: args[1] - args[0])
+        self.__sync_positions = timed(
+            'sync scan', self.__sync_positions,
+            lambda args, result: args[2] - args[1])
+        self.__parse_frame_header = timed('frame headers',
+                                          self.__parse_frame_header)
+        self.__decode_utf8 = timed('utf8', self.__decode_utf8)
+        self.__check_crc8 = timed('crc8', self.__check_crc8)
+        self.__frame_crc = timed('crc16', self.__frame_crc,
+                                 lambda args, result: len(args[0]))
+        self.parse_one_frame = timed('parse one frame', self.parse_one_frame)
+        self.decode_frame_at = timed('decode', self.decode_frame_at,
+                                     lambda args, result: args[1] - args[0])
+        self.parse_frames = timed('parse frames', self.parse_frames)
+        self.verify = timed('verify', self.verify)
+        self.save_frames_report = timed('report', self.save_frames_report)
+
+    @property
+    def tags(self):
+        if 'tags' not in self.__blocks:
+            self.__blocks['tags'] = None
+            if 'vorbis comment' in self.positions:
+                self.__blocks['tags'] = self.parse_vorbis_comment()
+        return self.__blocks['tags']
+
+    @property
+    def picture(self):
+        if 'picture' not in self.__blocks:
+            self.__blocks['picture'] = []
+            if 'picture' in self.positions:
+                for i in range(0, len(self.positions['picture'])):
+                    self.__blocks['picture'].append(self.parse_picture(i))
+        return self.__blocks['picture']
+
+    @property
+    def cuesheet(self):
+        if 'cuesheet' not in self.__blocks:
+            self.__blocks['cuesheet'] = {}
+            if 'cuesheet' in self.positions:
+                self.__blocks['cuesheet'] = self.parse_cuesheet()
+        return self.__blocks['cuesheet']
+
+    @property
+    def seektable(self):
+        if 'seektable' not in self.__blocks:
+            self.__blocks['seektable'] = []
+            if 'seektable' in self.positions:
+                self.__blocks['seektable'] = self.parse_seektable()
+        return self.__blocks['seektable']
+
+    def __open_buffer(self):
         with open(self.filename, 'rb') as f:
-            file = f.read()
-            if file[0:4].decode() != 'fLaC':
+            try:
+                self.__mapping = mmap.mmap(f.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+            except ValueError:
                 raise ValueError('file is not flac')
+        return memoryview(self.__mapping)
+
+    def __open_source(self, source):
+        if hasattr(source, 'view'):
+            return memoryview(source.view())
+        return self.__read_stream(SourceStream(source))
+
+    def __read_stream(self, f):
+        reads = self.metadata_reads()
+        size = next(reads)
+        try:
+            while True:
+                size = reads.send(read_exactly(f, size))
+        except StopIteration as stop:
+            data = stop.value
+        self.__stream = f
+        return memoryview(bytes(data))
+
+    @classmethod
+    def metadata_reads(cls):
+        data = bytearray((yield 4))
+        if data != b'fLaC':
+            raise ValueError('file is not flac')
+        is_last = False
+        while not is_last:
+            header = yield 4
+            if len(header) < 4:
+                raise ValueError('file is not flac')
+            is_last, type_of_block, size = \
+                cls.parse_metadata_block_header(header)
+            data += header + (yield size)
+        data += yield max_header_size
+        return data
+
+    def close(self):
+        self.buffer.release()
+        if self.__mapping is not None:
+            self.__mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def file_is_flac(self):
+        if self.buffer[0:4] != b'fLaC':
+            raise ValueError('file is not flac')
 
     @staticmethod
     def parse_metadata_block_header(header):
-        flag_and_type = bin(header[0])[2:].zfill(8)
-        is_last = int(flag_and_type[0])
-        type_of_block = int(flag_and_type[1:], 2)
+        is_last = header[0] >> 7
+        type_of_block = header[0] & 0x7f
         size = int.from_bytes(header[1:], byteorder='big')
         return is_last, type_of_block, size
 
     def parse_vorbis_comment(self):
         tags = {}
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-            begin, end = self.positions['vorbis comment']
-            block = file[begin:end]
+        begin, end = self.positions['vorbis comment']
+        block = self.buffer[begin:end]
         vendor_length = int.from_bytes(block[0:4], byteorder='little')
-        vendor = block[4:4+vendor_length].decode()
+        vendor = bytes(block[4:4+vendor_length]).decode()
         tags['vendor'] = vendor
         tags_count = int.from_bytes(block[4+vendor_length:8+vendor_length],
                                     byteorder='little')
@@ -58,7 +248,7 @@ class AudioFile:
         tag_regex = re.compile('(.+?)=(.+)')
         for i in range(0, tags_count):
             length = int.from_bytes(block[pos:pos+4], byteorder='little')
-            tag = tag_regex.match(block[pos+4:pos+4+length].decode())
+            tag = tag_regex.match(bytes(block[pos+4:pos+4+length]).decode())
             if tag:
                 tag_name = tag.group(1)
                 tag_value = tag.group(2)
@@ -70,10 +260,8 @@ class AudioFile:
         return tags
 
     def parse_streaminfo(self):
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-            begin, end = self.positions['streaminfo']
-            block = file[begin:end]
+        begin, end = self.positions['streaminfo']
+        block = self.buffer[begin:end]
         self.streaminfo['block_minsize'] = \
             int.from_bytes(block[0:2], byteorder='big')
         self.streaminfo['block_maxsize'] = \
@@ -82,17 +270,16 @@ class AudioFile:
             int.from_bytes(block[4:7], byteorder='big')
         self.streaminfo['frame_maxsize'] = \
             int.from_bytes(block[7:10], byteorder='big')
-        data = bin(int.from_bytes(block[10:18], byteorder='big'))[2:].zfill(64)
-        self.streaminfo['rate'] = int(data[0:20], 2)
-        self.streaminfo['channels'] = int(data[20:23], 2) + 1
-        self.streaminfo['bits per sample'] = int(data[23:28], 2) + 1
-        self.streaminfo['samples in flow'] = int(data[28:64], 2)
+        data = int.from_bytes(block[10:18], byteorder='big')
+        self.streaminfo['rate'] = data >> 44
+        self.streaminfo['channels'] = (data >> 41 & 0x7) + 1
+        self.streaminfo['bits per sample'] = (data >> 36 & 0x1f) + 1
+        self.streaminfo['samples in flow'] = data & 0xfffffffff
+        self.md5 = bytes(block[18:34])
 
     def parse_picture(self, i):
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-            begin, end = self.positions['picture'][i]
-            block = file[begin:end]
+        begin, end = self.positions['picture'][i]
+        block = self.buffer[begin:end]
 
         ext_len = int.from_bytes(block[4:8], byteorder='big')
         descr_len = int.from_bytes(block[8 + ext_len:12 + ext_len],
@@ -108,16 +295,15 @@ class AudioFile:
         width, height = self.__get_sizes(block, ext_len, descr_len)
         color_depth, number_of_colors = \
             self.__get_colors(block, ext_len, descr_len)
-        pic = self.__get_picture(block, ext_len, descr_len, pic_len)
-        return {'picture type': pic_type,
-                'mime type': mime_type,
-                'extension': ext,
-                'description': descr,
-                'width': width,
-                'height': height,
-                'color depth': color_depth,
-                'number of colors': number_of_colors,
-                'pic': pic}
+        return Picture(self, {'picture type': pic_type,
+                              'mime type': mime_type,
+                              'extension': ext,
+                              'description': descr,
+                              'width': width,
+                              'height': height,
+                              'color depth': color_depth,
+                              'number of colors': number_of_colors},
+                       begin + 32 + ext_len + descr_len, pic_len)
 
     @staticmethod
     def __get_pic_type(block):
@@ -126,11 +312,11 @@ class AudioFile:
 
     @staticmethod
     def __get_mime_type(block, ext_len):
-        return block[8:8+ext_len].decode()
+        return bytes(block[8:8+ext_len]).decode()
 
     @staticmethod
     def __get_description(block, ext_len, descr_len):
-        return block[12 + ext_len:12 + ext_len + descr_len].decode()
+        return bytes(block[12 + ext_len:12 + ext_len + descr_len]).decode()
 
     @staticmethod
     def __get_sizes(block, ext_len, descr_len):
@@ -152,45 +338,37 @@ class AudioFile:
                                           byteorder='big')
         return color_depth, number_of_colors
 
-    @staticmethod
-    def __get_picture(block, ext_len, descr_len, pic_len):
-        return block[32+ext_len+descr_len:32+ext_len+descr_len+pic_len]
-
     def parse_metadata(self):
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-            pos = 4
-            is_last = False
-            while not is_last:
-                is_last, type_of_block, size = \
-                    self.parse_metadata_block_header(file[pos:pos+4])
-                positions = (pos+4, pos+4+size)
-                if type_of_block == 0:
-                    self.positions['streaminfo'] = positions
-                if type_of_block == 4:
-                    self.positions['vorbis comment'] = positions
-                if type_of_block == 6:
-                    if 'picture' not in self.positions:
-                        self.positions['picture'] = [positions]
-                    else:
-                        self.positions['picture'].append(positions)
-                if type_of_block == 5:
-                    self.positions['cuesheet'] = positions
-                pos += size + 4
-                if type_of_block == 3:
-                    self.positions['seektable'] = positions
+        pos = 4
+        is_last = False
+        while not is_last:
+            is_last, type_of_block, size = \
+                self.parse_metadata_block_header(self.buffer[pos:pos+4])
+            positions = (pos+4, pos+4+size)
+            if type_of_block == 0:
+                self.positions['streaminfo'] = positions
+            if type_of_block == 4:
+                self.positions['vorbis comment'] = positions
+            if type_of_block == 6:
+                if 'picture' not in self.positions:
+                    self.positions['picture'] = [positions]
+                else:
+                    self.positions['picture'].append(positions)
+            if type_of_block == 5:
+                self.positions['cuesheet'] = positions
+            pos += size + 4
+            if type_of_block == 3:
+                self.positions['seektable'] = positions
         return pos
 
     def parse_cuesheet(self):
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-            begin, end = self.positions['cuesheet']
-            block = file[begin:end]
+        begin, end = self.positions['cuesheet']
+        block = self.buffer[begin:end]
         cuesheet = {}
-        cuesheet['media catalog number'] = block[0:128].decode()
+        cuesheet['media catalog number'] = bytes(block[0:128]).decode()
         cuesheet['lead in samples'] = int.from_bytes(block[128:136],
                                                      byteorder='big')
-        cuesheet['corresponds to cd'] = int(bin(block[136])[2])
+        cuesheet['corresponds to cd'] = block[136] >> 7
         number_of_tracks = block[395]
         cuesheet['tracks'] = []
         pos = 396
@@ -199,11 +377,10 @@ class AudioFile:
             cuesheet['tracks'][i]['offset'] = int.from_bytes(block[pos:pos+8],
                                                              byteorder='big')
             cuesheet['tracks'][i]['track number'] = block[pos+8]
-            cuesheet['tracks'][i]['isrc'] = block[pos+9:pos+21].decode()
-            cuesheet['tracks'][i]['is audio'] = int(bin(block[pos+21])
-                                                    .zfill(8)[2])
-            cuesheet['tracks'][i]['pre-emphasis'] = int(bin(block[pos+21])
-                                                        .zfill(8)[3])
+            cuesheet['tracks'][i]['isrc'] = \
+                bytes(block[pos+9:pos+21]).decode()
+            cuesheet['tracks'][i]['is audio'] = block[pos+21] >> 7
+            cuesheet['tracks'][i]['pre-emphasis'] = block[pos+21] >> 6 & 1
             number_of_track_points = block[pos+35]
             pos += 36
             cuesheet['tracks'][i]['track index'] = []
@@ -217,169 +394,583 @@ class AudioFile:
         return cuesheet
 
     def parse_seektable(self):
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-            begin, end = self.positions['seektable']
-            block = file[begin:end]
+        begin, end = self.positions['seektable']
+        block = self.buffer[begin:end]
         pos = 0
         seektable = []
         counter = 0
         while pos + 17 < len(block):
             seektable.append({})
-            seektable[counter]['first sample'] = block[pos:pos+8]
-            seektable[counter]['offset'] = block[pos+8:pos+16]
-            seektable[counter]['number of samples'] = block[pos+16:pos+18]
+            seektable[counter]['first sample'] = \
+                int.from_bytes(block[pos:pos+8], byteorder='big')
+            seektable[counter]['offset'] = \
+                int.from_bytes(block[pos+8:pos+16], byteorder='big')
+            seektable[counter]['number of samples'] = \
+                int.from_bytes(block[pos+16:pos+18], byteorder='big')
             pos += 18
             counter += 1
         return seektable
 
     def __get_blocking_strategy(self):
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-        return bin(file[self.first_frame + 1])[-1]
+        return str(self.buffer[self.first_frame + 1] & 1)
 
-    def parse_frames(self):
-        with open(self.filename, 'rb') as f:
-            file = f.read()
-            pos = self.first_frame
-            counter = -1
-            while pos < len(file):
-                if not (b'\xff\xfb' >= file[pos:pos+2] >= b'\xff\xf8'):
-                    pos += 1
-                else:
-                    counter += 1
-                    try:
-                        block_size, sample_rate, channels, sample_size, \
-                         offset, \
-                         frame_sample_number = \
-                         self.parse_one_frame(file, pos, counter)
-                    except ValueError:
-                        counter -= 1
-                        pos += 1
+    def __build_header_tables(self):
+        self.__blocking_bit = int(self.blocking_strategy)
+        self.__block_sizes = [self.streaminfo['block_maxsize']] + \
+            [constants.block_size.get(code) for code in range(1, 16)]
+        self.__sample_rates = [self.streaminfo['rate']] + \
+            [constants.sample_rate.get(code) for code in range(1, 16)]
+        self.__channels = [code + 1 for code in range(0, 8)] + \
+            [constants.channels.get(code) for code in range(8, 16)]
+        self.__sample_sizes = [self.streaminfo['bits per sample']] + \
+            [constants.sample_size.get(code) for code in range(1, 8)]
+
+    def __new_frame_index(self):
+        return FrameIndex(self.blocking_strategy == '1',
+                          self.streaminfo['block_maxsize'])
+
+    def parse_frames(self, cache=None):
+        if cache:
+            frames = cache.load(self)
+            if frames is not None:
+                self.frames = frames
+                return
+        self.__scan_frames()
+        if cache:
+            cache.store(self, self.frames)
+
+    def __scan_frames(self):
+        self.frames = self.__new_frame_index()
+        window = self.__window()
+        end = None
+        for pos, header, end, crc_ok in self.__frame_headers(window):
+            block_size, sample_rate, channels, sample_size, offset, \
+                frame_sample_number = header
+            self.frames.append(pos, block_size, sample_rate, channels,
+                               sample_size, frame_sample_number, crc_ok)
+        self.frames.end_offset = end if end is not None \
+            else window.base + len(window.data)
+
+    def iter_frames(self, decode=False):
+        window = self.__window()
+        for pos, header, end, crc_ok in self.__frame_headers(window):
+            block_size, sample_rate, channels, sample_size, offset, \
+                frame_sample_number = header
+            frame = {'block size': block_size,
+                     'sample rate': sample_rate,
+                     'channels': channels,
+                     'sample size': sample_size,
+                     'offset': pos,
+                     'sample number': frame_sample_number,
+                     'crc ok': crc_ok}
+            if not decode:
+                yield frame
+                continue
+            try:
+                samples, end = decoder.decode_frame(
+                    window.data, offset - window.base, end - window.base,
+                    block_size, channels, sample_size)
+            except ValueError:
+                samples = None
+            yield frame, samples
+
+    def __window(self):
+        if self.__stream is None:
+            return BufferWindow(self.buffer)
+        if self.__stream is False:
+            raise ValueError('stream has already been read')
+        stream = self.__stream
+        if isinstance(stream, SourceStream):
+            stream = SourceStream(stream.source, len(self.buffer))
+        else:
+            self.__stream = False
+        window = StreamWindow(stream, self.buffer[self.first_frame:],
+                              self.first_frame,
+                              max(self.streaminfo['frame_maxsize'], 4096))
+        if self.stats:
+            window.read = self.stats.timed('read', window.read,
+                                           lambda args, result: len(result))
+        return window
+
+    def __read(self, begin, end):
+        if isinstance(self.__stream, SourceStream):
+            return memoryview(self.__stream.source.read_at(begin,
+                                                           end - begin)), begin
+        if self.__is_stream() and end > len(self.buffer):
+            raise ValueError(stream_access_error)
+        return self.buffer, 0
+
+    def __is_stream(self):
+        return self.__stream is not None and \
+            not isinstance(self.__stream, SourceStream)
+
+    def read_at(self, offset, size):
+        buffer, base = self.__read(offset, offset + size)
+        return bytes(buffer[offset - base:offset - base + size])
+
+    def __frame_size_bound(self):
+        block_size = self.streaminfo['block_maxsize'] or 0xffff
+        return (block_size * self.streaminfo['channels'] *
+                (self.streaminfo['bits per sample'] + 1) + 7) // 8 + 1024
+
+    def __frame_headers(self, window):
+        frame_maxsize = self.streaminfo['frame_maxsize'] or \
+            self.__frame_size_bound()
+        frame_minsize = min(self.streaminfo['frame_minsize'], frame_maxsize)
+        step = max(frame_maxsize - frame_minsize, max_header_size)
+        candidates = []
+        scanned = [self.first_frame]
+        stats = self.stats
+
+        def scan(begin, end):
+            base = window.base
+            return [(pos + base, header[:4] + (header[4] + base,) + header[5:])
+                    for pos, header in self.__find_headers(
+                        window.data, begin - base, end - base)]
+
+        def collect(begin=0, size=scan_chunk_size):
+            while True:
+                end = window.base + len(window.data)
+                if not window.eof:
+                    end -= max_header_size
+                begin = max(begin, scanned[0])
+                end = min(end, begin + size)
+                if begin < end:
+                    if stats and begin > scanned[0]:
+                        stats.count('skipped bytes', begin - scanned[0])
+                    candidates.extend(scan(begin, end))
+                    scanned[0] = end
+                    return True
+                if window.eof:
+                    return False
+                window.more()
+
+        i = 0
+        while True:
+            while i == len(candidates):
+                del candidates[:]
+                i = 0
+                if not collect(size=max(step, 4096)):
+                    return
+                window.discard(candidates[0][0] if candidates
+                               else scanned[0])
+            pos, header = candidates[i]
+            earliest = max(header[4], pos + frame_minsize)
+            gap = None
+            while True:
+                crc, checked = 0, pos
+                following = last_end = None
+                crc_ok = False
+                j = i + 1
+                while True:
+                    if j == len(candidates):
+                        if scanned[0] - pos <= frame_maxsize:
+                            if gap is None and scanned[0] < earliest:
+                                gap = scanned[0], earliest
+                            if collect(earliest, step):
+                                continue
+                        if earliest == header[4]:
+                            last_end = self.__last_frame_end(
+                                window, pos, header, crc, checked)
+                            crc_ok = last_end is not None
+                        break
+                    candidate, next_header = candidates[j]
+                    j += 1
+                    if candidate < earliest:
                         continue
-                    self.frames.append({})
-                    self.frames[counter]['block size'] = block_size
-                    self.frames[counter]['sample rate'] = sample_rate
-                    self.frames[counter]['channels'] = channels
-                    self.frames[counter]['sample size'] = sample_size
-                    self.frames[counter]['offset'] = pos
-                    pos = offset
-                    if self.blocking_strategy:
-                        self.frames[counter]['sample number'] = \
-                            frame_sample_number
+                    if candidate - pos > frame_maxsize:
+                        break
+                    crc = self.__frame_crc(
+                        window.data[checked - window.base:
+                                    candidate - window.base], crc)
+                    checked = candidate
+                    if crc == 0:
+                        if earliest == header[4] or \
+                                self.__continues(header, next_header):
+                            following, crc_ok = j - 1, True
+                        break
+                if not crc_ok and gap is not None:
+                    k = i + 1
+                    while k < len(candidates) and candidates[k][0] < gap[0]:
+                        k += 1
+                    candidates[k:k] = scan(*gap)
+                    gap = None
+                if crc_ok or earliest == header[4]:
+                    break
+                if stats:
+                    stats.count('skip retries')
+                earliest = header[4]
+            if not crc_ok:
+                following = self.__resync(candidates, i, frame_maxsize)
+                if stats:
+                    stats.count('resyncs')
+            if following is not None:
+                end = candidates[following][0]
+            elif last_end is not None:
+                end = last_end
+            else:
+                end = min(scanned[0], window.base + len(window.data))
+            if stats:
+                stats.count('frames')
+                if not crc_ok:
+                    stats.count('crc16 failures')
+            yield pos, header, end, crc_ok
+            if following is None:
+                i = len(candidates)
+                continue
+            i = following
+            if i > 4096:
+                del candidates[:i]
+                i = 0
+            window.discard(candidates[i][0])
+
+    def __last_frame_end(self, window, pos, header, crc, checked):
+        try:
+            samples, end = decoder.decode_frame(
+                window.data, header[4] - window.base, len(window.data),
+                header[0], header[2], header[3])
+            if self.__frame_crc(window.data[pos - window.base:end], 0) == 0:
+                return end + window.base
+        except (ValueError, IndexError):
+            pass
+        if window.eof and self.__frame_crc(
+                window.data[checked - window.base:], crc) == 0:
+            return window.base + len(window.data)
+        return None
+
+    def __resync(self, candidates, i, frame_maxsize):
+        pos, header = candidates[i]
+        first = None
+        for k in range(i + 1, len(candidates)):
+            candidate, following = candidates[k]
+            if candidate < header[4]:
+                continue
+            if first is None:
+                first = k
+            if self.__continues(header, following):
+                return k
+            if candidate - pos > frame_maxsize:
+                break
+        return first
+
+    def __find_headers(self, file, begin, end):
+        headers = []
+        positions = self.__sync_positions(file, begin, end)
+        for pos in positions:
+            try:
+                headers.append((pos, self.__parse_frame_header(file, pos)))
+            except (ValueError, IndexError):
+                continue
+        valid = self.__check_crc8(file, headers)
+        if self.stats:
+            self.stats.count('sync candidates', len(positions))
+            self.stats.count('invalid headers', len(positions) - len(headers))
+            self.stats.count('crc8 mismatches', len(headers) - len(valid))
+        return valid
 
     @staticmethod
-    def __decode_utf8(file, pos):
-        number_of_bytes = 1
-        first_byte = bin(file[pos])[2:].zfill(8)
-        while first_byte[number_of_bytes - 1] == '1':
-            number_of_bytes += 1
-            if number_of_bytes == 8:
-                raise ValueError()
-        if number_of_bytes == 1:
-            number = first_byte[1:]
+    def __sync_positions(file, begin, end):
+        return [candidate.start()
+                for candidate in sync_regex.finditer(file, begin, end + 1)]
+
+    @staticmethod
+    def __check_crc8(file, headers):
+        crcs = crc8.get_crcs(file, [(pos, header[4] - 1)
+                                    for pos, header in headers])
+        return [(pos, header) for (pos, header), crc in zip(headers, crcs)
+                if header[4] <= len(file) and file[header[4] - 1] == crc]
+
+    def seek(self, sample):
+        total = self.streaminfo['samples in flow']
+        if sample < 0 or total and sample >= total:
+            raise ValueError('sample {} is out of range'.format(sample))
+        if len(self.frames):
+            i = self.frames.frame_for_sample(sample)
+            frame = self.frames[i]
+            frame['first sample'] = self.frames.first_samples[i]
+            return frame
+        if self.__is_stream():
+            raise ValueError(stream_access_error)
+        points = sorted((point['first sample'], point['offset'])
+                        for point in self.seektable
+                        if point['first sample'] != placeholder_point)
+        i = bisect_right(points, (sample, placeholder_point)) - 1
+        if i >= 0:
+            pos = self.first_frame + points[i][1]
+        elif not self.__blocking_bit and total and \
+                self.__size() is not None:
+            pos = self.__interpolate(sample)
         else:
-            number_of_bytes -= 1
-            number = first_byte[number_of_bytes + 1:]
-        for i in range(pos + 1, pos + number_of_bytes):
-            number += bin(file[i])[4:]
-        return number_of_bytes, int(number, 2)
-
-    def __get_block_size(self, file, pos, length, block_size):
-        block_size_len = 0
-        if block_size == 0:
-            block_size = self.streaminfo['block_maxsize']
-        if block_size == 1:
-            block_size = 192
-        if 2 <= block_size <= 5:
-            block_size = 576 * 2 ** (block_size - 2)
-        if 8 <= block_size <= 15:
-            block_size = 256 * 2 ** (block_size - 8)
-        if block_size == 6:
-            block_size = file[pos + 4 + length] + 1
-            block_size_len = 1
-        if block_size == 7:
-            block_size = int.from_bytes(file[pos + 4 + length:
-                                             pos + 6 + length],
-                                        byteorder='big') + 1
-            block_size_len = 2
-        return block_size, block_size_len
+            pos = self.first_frame
+        try:
+            return self.__scan_to_sample(pos, sample)
+        except (ValueError, IndexError):
+            if pos == self.first_frame:
+                raise ValueError('no frame contains sample {}'.format(sample))
+            return self.__scan_to_sample(self.first_frame, sample)
 
-    def __get_sample_rate(self, file, pos, length, block_size_len,
-                          sample_rate):
-        sample_rate_len = 0
-        if sample_rate == 15:
-            raise ValueError()
-        if sample_rate == 0:
-            sample_rate = self.streaminfo['rate']
-        if 1 <= sample_rate <= 11:
-            sample_rate = constants.sample_rate[sample_rate]
-        if sample_rate == 12:
-            sample_rate = file[pos + 4 + length + block_size_len]
-            sample_rate_len = 1
-        if sample_rate == 13:
-            sample_rate = int.from_bytes(file[pos+4+length+block_size_len:
-                                              pos+6+length+block_size_len],
-                                         byteorder='big') / 1000
-            sample_rate_len = 2
-        if sample_rate == 14:
-            sample_rate = int.from_bytes(file[pos+4+length+block_size_len:
-                                              pos+6+length+block_size_len],
-                                         byteorder='big') / 100
-            sample_rate_len = 2
-        return sample_rate, sample_rate_len
+    def __size(self):
+        if isinstance(self.__stream, SourceStream):
+            return self.__stream.source.size
+        return len(self.buffer)
 
-    def parse_one_frame(self, file, pos, counter):
-        if bin(file[pos + 1])[-1] != self.blocking_strategy:
-            raise ValueError()
-        length, frame_sample_number = self.__decode_utf8(file, pos + 4)
-        data = bin(file[pos + 2])[2:].zfill(8)
-        block_size = int(data[:4], 2)
-        block_size, block_size_len = self.__get_block_size(file, pos, length,
-                                                           block_size)
+    def __header_at(self, pos):
+        buffer, base = self.__read(pos, pos + max_header_size)
+        header = self.parse_one_frame(buffer, pos - base, -1)
+        return header[:4] + (header[4] + base,) + header[5:]
 
-        sample_rate = int(data[4:], 2)
+    def __seek_window(self, begin):
+        chunk = max(2 * self.streaminfo['frame_maxsize'], 4096)
+        start = begin - begin % chunk
+        if self.__last_window is None or self.__last_window[2] != start:
+            buffer, base = self.__read(start, start + chunk + max_header_size)
+            self.__last_window = buffer, base, start
+        return start + chunk, self.__last_window[0], self.__last_window[1]
 
-        sample_rate, sample_rate_len = self.__get_sample_rate(file, pos,
-                                                              length,
-                                                              block_size_len,
-                                                              sample_rate)
+    def __headers_from(self, begin, end):
+        last = end - 1 if end is not None else None
+        while last is None or begin < last:
+            stop, buffer, base = self.__seek_window(begin)
+            if last is not None:
+                stop = min(stop, last)
+            if len(buffer) - (begin - base) < 2:
+                return
+            for candidate in sync_regex.finditer(buffer, begin - base,
+                                                 stop + 1 - base):
+                try:
+                    header = self.parse_one_frame(buffer, candidate.start(),
+                                                  -1)
+                except (ValueError, IndexError):
+                    continue
+                yield candidate.start() + base, \
+                    header[:4] + (header[4] + base,) + header[5:]
+            begin = stop
 
-        data = bin(file[pos + 3])[2:].zfill(8)
-        channels = int(data[:4], 2)
+    def __scan_to_sample(self, pos, sample):
+        header = self.__header_at(pos)
+        while True:
+            first_sample = self.__first_sample(header)
+            if sample < first_sample:
+                raise ValueError()
+            if sample < first_sample + header[0]:
+                block_size, sample_rate, channels, sample_size, offset, \
+                    frame_sample_number = header
+                return {'block size': block_size,
+                        'sample rate': sample_rate,
+                        'channels': channels,
+                        'sample size': sample_size,
+                        'offset': pos,
+                        'sample number': frame_sample_number,
+                        'first sample': first_sample}
+            pos, header = self.__following_header(pos, header, self.__size())
 
-        if channels >= 11:
-            raise ValueError()
-        if 0 <= channels <= 7:
-            channels += 1
-        else:
-            channels = constants.channels[channels]
+    def __following_header(self, pos, header, end):
+        for candidate, following in self.__headers_from(header[4], end):
+            if self.__continues(header, following):
+                return candidate, following
+        raise ValueError()
+
+    def __interpolate(self, sample):
+        block_size = self.streaminfo['block_maxsize']
+        window = max(self.streaminfo['frame_maxsize'], 1 << 16)
+        target = sample // block_size
+        lo, lo_number = self.first_frame, 0
+        hi = self.__size()
+        hi_number = -(-self.streaminfo['samples in flow'] // block_size)
+        for _ in range(0, 32):
+            if hi - lo <= 2 * window or hi_number <= lo_number:
+                break
+            guess = lo + 1 + (hi - lo - 1) * (target - lo_number) // \
+                (hi_number - lo_number)
+            found = self.__confirmed_header(guess, hi, window)
+            if found is None:
+                break
+            pos, number = found
+            if number == target:
+                return pos
+            if number > target:
+                hi, hi_number = pos, number
+            else:
+                lo, lo_number = pos, number
+        return lo
 
-        sample_size = int(data[4:7], 2)
+    def __confirmed_header(self, begin, end, window):
+        for pos, header in self.__headers_from(begin, end):
+            try:
+                self.__following_header(pos, header,
+                                        min(header[4] + window, self.__size()))
+            except (ValueError, IndexError):
+                continue
+            return pos, header[5]
+        return None
 
-        if sample_size == 3 or sample_size == 7:
+    def __first_sample(self, header):
+        if self.__blocking_bit:
+            return header[5]
+        return header[5] * self.streaminfo['block_maxsize']
+
+    def __continues(self, header, following):
+        if self.__blocking_bit:
+            return following[5] == header[5] + header[0]
+        return following[5] == header[5] + 1
+
+    @staticmethod
+    def __decode_utf8(file, pos):
+        number_of_bytes, mask = utf8_headers[file[pos]]
+        if not number_of_bytes:
             raise ValueError()
-        if sample_size == 0:
-            sample_size = self.streaminfo['bits per sample']
-        else:
-            sample_size = constants.sample_size[sample_size]
+        number = file[pos] & mask
+        for byte in file[pos + 1:pos + number_of_bytes]:
+            if byte & 0xc0 != 0x80:
+                raise ValueError()
+            number = number << 6 | byte & 0x3f
+        return number_of_bytes, number
 
+    def parse_one_frame(self, file, pos, counter):
+        header = self.__parse_frame_header(file, pos)
         if self.blocking_strategy == 0:
-            if frame_sample_number != counter:
+            if header[5] != counter:
                 raise ValueError()
-
-        end_pos = pos + 4 + block_size_len + sample_rate_len + length
+        end_pos = header[4] - 1
         if file[end_pos] != crc8.get_crc(file[pos:end_pos]):
             raise ValueError()
-        pos += 5 + block_size_len + sample_rate_len + length
-        return block_size, sample_rate, channels, sample_size, pos, \
+        return header
+
+    def __parse_frame_header(self, file, pos):
+        if file[pos + 1] & 1 != self.__blocking_bit:
+            raise ValueError()
+        length, frame_sample_number = self.__decode_utf8(file, pos + 4)
+        end_pos = pos + 4 + length
+        code = file[pos + 2]
+        block_size = self.__block_sizes[code >> 4]
+        if block_size is None:
+            block_size_len = (code >> 4) - 5
+            block_size = int.from_bytes(file[end_pos:end_pos +
+                                             block_size_len],
+                                        byteorder='big') + 1
+            end_pos += block_size_len
+
+        sample_rate = self.__sample_rates[code & 0xf]
+        if sample_rate is None:
+            if code & 0xf == 15:
+                raise ValueError()
+            if code & 0xf == 12:
+                sample_rate = file[end_pos]
+                end_pos += 1
+            else:
+                sample_rate = int.from_bytes(file[end_pos:end_pos + 2],
+                                             byteorder='big')
+                sample_rate /= 1000 if code & 0xf == 13 else 100
+                end_pos += 2
+
+        code = file[pos + 3]
+        channels = self.__channels[code >> 4]
+        if channels is None:
+            raise ValueError()
+        sample_size = self.__sample_sizes[code >> 1 & 0x7]
+        if sample_size is None:
+            raise ValueError()
+        return block_size, sample_rate, channels, sample_size, end_pos + 1, \
             frame_sample_number
 
-    def save_picture(self):
-        with open('{0}pic.{1}'.
-                  format(self.filename.split('.')[0],
-                         self.picture[0]['extension']), 'wb') as f:
-            f.write(self.picture[0]['pic'])
+    def decode_frame(self, i):
+        if not len(self.frames):
+            self.parse_frames()
+        samples, end = self.__decode_frame(range(0, len(self.frames))[i])
+        return samples
+
+    def __decode_frame(self, i):
+        if i + 1 < len(self.frames):
+            end = self.frames.offsets[i + 1]
+        else:
+            end = self.frames.end_offset
+        return self.decode_frame_at(self.frames.offsets[i], end)
+
+    def decode_frame_at(self, offset, end):
+        buffer, base = self.__read(offset, end)
+        block_size, sample_rate, channels, sample_size, pos, \
+            frame_sample_number = \
+            self.parse_one_frame(buffer, offset - base, -1)
+        samples, end = decoder.decode_frame(buffer, pos, end - base,
+                                            block_size, channels, sample_size)
+        return samples, end + base
+
+    def iter_decoded(self, start=0, stop=None):
+        if not len(self.frames):
+            self.parse_frames()
+        if stop is None:
+            stop = len(self.frames)
+        for i in range(start, stop):
+            yield self.decode_frame(i)
+
+    def decode(self):
+        channels = [array('i') for i in range(0, self.streaminfo['channels'])]
+        for samples in self.iter_decoded():
+            for channel, channel_samples in zip(channels, samples):
+                channel.extend(channel_samples)
+        return channels
+
+    def verify(self):
+        if self.__is_stream():
+            return self.__verify_stream()
+        if not len(self.frames):
+            self.parse_frames()
+        md5 = hashlib.md5()
+        crc_failures = []
+        decode_failures = []
+        samples_count = 0
+        for i in range(0, len(self.frames)):
+            try:
+                samples, end = self.__decode_frame(i)
+            except ValueError:
+                decode_failures.append(i)
+                continue
+            buffer, base = self.__read(self.frames.offsets[i], end)
+            if crc16.get_crc(buffer[self.frames.offsets[i] - base:
+                                    end - base]):
+                crc_failures.append(i)
+            md5.update(decoder.to_bytes(samples,
+                                        self.streaminfo['bits per sample']))
+            samples_count += len(samples[0])
+        return self.__verify_report(len(self.frames), samples_count,
+                                    crc_failures, decode_failures, md5)
+
+    def __verify_stream(self):
+        md5 = hashlib.md5()
+        crc_failures = []
+        decode_failures = []
+        samples_count = 0
+        frames = 0
+        for i, (frame, samples) in enumerate(self.iter_frames(decode=True)):
+            frames += 1
+            if samples is None:
+                decode_failures.append(i)
+                continue
+            if not frame['crc ok']:
+                crc_failures.append(i)
+            md5.update(decoder.to_bytes(samples,
+                                        self.streaminfo['bits per sample']))
+            samples_count += len(samples[0])
+        return self.__verify_report(frames, samples_count, crc_failures,
+                                    decode_failures, md5)
+
+    def __verify_report(self, frames, samples_count, crc_failures,
+                        decode_failures, md5):
+        md5_ok = None
+        if any(self.md5):
+            md5_ok = md5.digest() == self.md5
+        return {'frames': frames,
+                'samples': samples_count,
+                'crc failures': crc_failures,
+                'decode failures': decode_failures,
+                'md5 ok': md5_ok}
+
+    def save_picture(self, i=0, path=None):
+        picture = self.picture[i]
+        if path is None:
+            path = '{0}pic.{1}'.format(os.path.splitext(self.filename)[0],
+                                       picture['extension'])
+        return picture.save(path)
 
     def make_text(self):
         text = constants.text.format(self.streaminfo['block_minsize'],
@@ -446,18 +1037,10 @@ class AudioFile:
         return text
 
     def save_frames_text(self):
-        text = ''
-        for i in range(0, len(self.frames)):
-            text += constants.frames_text.format(i,
-                                                 self.frames[i]['offset'],
-                                                 self.frames[i]['block size'],
-                                                 self.frames[i]['sample rate'],
-                                                 self.frames[i]['channels'],
-                                                 self.frames[i]['sample size'])
-            if self.blocking_strategy:
-                text += \
-                    constants.sample_number_text.format(self.frames[i]
-                                                        ['sample number'])
-            text += '\n\n'
-        with open(self.filename.split('.')[0] + ' frames.txt', 'w') as f:
-            f.write(text)
+        return self.save_frames_report('text')
+
+    def save_frames_report(self, format='text', path=None):
+        if path is None:
+            path = '{0} frames{1}'.format(os.path.splitext(self.filename)[0],
+                                          report.extensions[format])
+        return report.save_report(self, path, format)
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import struct
+from frame_index import FrameIndex
+magic = b'FLFI'
+version = 2
+header = struct.Struct('<4sHQQ16s')
+
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'flacDecoder', 'frames')
+
+
+class FrameCache:
+    def __init__(self, directory=None, max_size=64 * 1024 * 1024):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+
+    def path(self, audio_file):
+        name = os.path.abspath(audio_file.filename).encode('utf-8',
+                                                           'surrogateescape')
+        return os.path.join(self.directory,
+                            hashlib.sha1(name).hexdigest() + '.idx')
+
+    @staticmethod
+    def key(audio_file):
+        stat = os.stat(audio_file.filename)
+        return stat.st_size, stat.st_mtime_ns, audio_file.md5
+
+    @staticmethod
+    def usable(audio_file):
+        return isinstance(audio_file.filename, str) and \
+            os.path.isfile(audio_file.filename)
+
+    def load(self, audio_file):
+        if not self.usable(audio_file):
+            return None
+        path = self.path(audio_file)
+        try:
+            with open(path, 'rb') as f:
+                file_magic, file_version, size, mtime, md5 = \
+                    header.unpack(f.read(header.size))
+                if file_magic != magic or file_version != version or \
+                        (size, mtime, md5) != self.key(audio_file):
+                    return None
+                frames = FrameIndex.read(f)
+        except (OSError, ValueError, EOFError, struct.error):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return frames
+
+    def store(self, audio_file, frames):
+        if not self.usable(audio_file):
+            return
+        path = self.path(audio_file)
+        temp = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp, 'wb') as f:
+                f.write(header.pack(magic, version, *self.key(audio_file)))
+                frames.write(f)
+            os.replace(temp, path)
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        try:
+            scanned = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in scanned:
+            if entry.name.endswith('.idx'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,121 @@
+from array import array
+from bisect import bisect_right
+import struct
+import constants
+
+
+class FrameIndex:
+    def __init__(self, variable_blocking=False, block_size=0):
+        self.variable_blocking = variable_blocking
+        self.block_size = block_size
+        self.end_offset = 0
+        self.offsets = array('q')
+        self.block_sizes = array('L')
+        self.numbers = array('Q')
+        self.first_samples = array('Q')
+        self.rate_codes = array('B')
+        self.channel_codes = array('B')
+        self.sample_sizes = array('B')
+        self.crc_ok = array('B')
+        self.rates = []
+        self.__rate_codes = {}
+
+    def columns(self):
+        return [self.offsets, self.block_sizes, self.numbers,
+                self.first_samples, self.rate_codes, self.channel_codes,
+                self.sample_sizes, self.crc_ok]
+
+    def write(self, f):
+        f.write(struct.pack('<?QqL', self.variable_blocking, self.block_size,
+                            self.end_offset, len(self.rates)))
+        for rate in self.rates:
+            f.write(struct.pack('<?d', isinstance(rate, int), rate))
+        for column in self.columns():
+            f.write(struct.pack('<cBQ', column.typecode.encode(),
+                                column.itemsize, len(column)))
+            column.tofile(f)
+
+    @classmethod
+    def read(cls, f):
+        variable_blocking, block_size, end_offset, rates_count = \
+            struct.unpack('<?QqL', f.read(struct.calcsize('<?QqL')))
+        index = cls(variable_blocking, block_size)
+        index.end_offset = end_offset
+        for i in range(0, rates_count):
+            is_int, rate = struct.unpack('<?d', f.read(9))
+            index.rates.append(int(rate) if is_int else rate)
+            index.__rate_codes[index.rates[-1]] = i
+        for column in index.columns():
+            typecode, itemsize, length = \
+                struct.unpack('<cBQ', f.read(struct.calcsize('<cBQ')))
+            if typecode.decode() != column.typecode or \
+                    itemsize != column.itemsize:
+                raise ValueError('incompatible frame index column')
+            column.fromfile(f, length)
+        return index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        channels = self.channel_codes[i]
+        return {'block size': self.block_sizes[i],
+                'sample rate': self.rates[self.rate_codes[i]],
+                'channels': channels + 1 if channels <= 7
+                else constants.channels[channels],
+                'sample size': self.sample_sizes[i],
+                'offset': self.offsets[i],
+                'sample number': self.numbers[i]}
+
+    def __iter__(self):
+        for i in range(0, len(self)):
+            yield self[i]
+
+    def append(self, offset, block_size, sample_rate, channels, sample_size,
+               number, crc_ok=True):
+        if sample_rate not in self.__rate_codes:
+            self.__rate_codes[sample_rate] = len(self.rates)
+            self.rates.append(sample_rate)
+        if isinstance(channels, str):
+            channels = constants.channel_codes[channels]
+        else:
+            channels -= 1
+        self.offsets.append(offset)
+        self.block_sizes.append(block_size)
+        self.numbers.append(number)
+        if self.variable_blocking:
+            self.first_samples.append(number)
+        else:
+            self.first_samples.append(number * self.block_size)
+        self.rate_codes.append(self.__rate_codes[sample_rate])
+        self.channel_codes.append(channels)
+        self.sample_sizes.append(sample_size)
+        self.crc_ok.append(crc_ok)
+
+    def crc_failures(self):
+        return [i for i, crc_ok in enumerate(self.crc_ok) if not crc_ok]
+
+    def frame_for_sample(self, sample):
+        i = bisect_right(self.first_samples, sample) - 1
+        if i < 0 or sample >= self.first_samples[i] + self.block_sizes[i]:
+            raise ValueError('sample {} is not in any frame'.format(sample))
+        return i
+
+    def frame_at_offset(self, offset):
+        i = bisect_right(self.offsets, offset) - 1
+        if i < 0 or offset >= self.end_offset:
+            raise ValueError('offset {} is not in any frame'.format(offset))
+        return i
+
+    def sizes(self):
+        sizes = array('q', self.offsets[1:])
+        sizes.append(self.end_offset)
+        for i in range(0, len(sizes)):
+            sizes[i] -= self.offsets[i]
+        return sizes
+
+    def bitrates(self, rate):
+        return array('d', [size * 8 * rate / block_size for size, block_size
+                           in zip(self.sizes(), self.block_sizes)])
@@ -0,0 +1,58 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+from flac import AudioFile
+
+
+def decode_range(filename, name, total, offsets, ends, positions):
+    memory = shared_memory.SharedMemory(name=name)
+    output = memory.buf.cast('i')
+    try:
+        with AudioFile(filename, lazy=True) as audio_file:
+            for offset, end, position in zip(offsets, ends, positions):
+                samples, end = audio_file.decode_frame_at(offset, end)
+                for i, channel in enumerate(samples):
+                    begin = i * total + position
+                    output[begin:begin + len(channel)] = channel
+    finally:
+        output.release()
+        memory.close()
+
+
+def decode_parallel(audio_file, workers=None, chunks_per_worker=4):
+    if not isinstance(audio_file.filename, str):
+        raise ValueError('parallel decoding needs a file on disk')
+    if not len(audio_file.frames):
+        audio_file.parse_frames()
+    frames = audio_file.frames
+    channels = audio_file.streaminfo['channels']
+    positions = array('q', [0])
+    for block_size in frames.block_sizes:
+        positions.append(positions[-1] + block_size)
+    total = positions.pop()
+    ends = array('q', frames.offsets[1:])
+    ends.append(frames.end_offset)
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, -(-len(frames) // (workers * chunks_per_worker)))
+    memory = shared_memory.SharedMemory(create=True,
+                                        size=max(1, 4 * channels * total))
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(decode_range, audio_file.filename,
+                                       memory.name, total,
+                                       frames.offsets[i:i + chunk],
+                                       ends[i:i + chunk],
+                                       positions[i:i + chunk])
+                       for i in range(0, len(frames), chunk)]
+            for future in futures:
+                future.result()
+        samples = []
+        for i in range(0, channels):
+            channel = array('i')
+            channel.frombytes(memory.buf[4 * i * total:4 * (i + 1) * total])
+            samples.append(channel)
+        return samples
+    finally:
+        memory.close()
+        memory.unlink()
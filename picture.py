@@ -0,0 +1,73 @@
+from collections.abc import Mapping
+import os
+
+copy_chunk_size = 1 << 20
+
+
+def copy_range(src, offset, length, dst):
+    remaining = length
+    try:
+        if hasattr(os, 'copy_file_range'):
+            while remaining:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(),
+                                            remaining, offset)
+                if not copied:
+                    break
+                offset += copied
+                remaining -= copied
+        elif hasattr(os, 'sendfile'):
+            while remaining:
+                copied = os.sendfile(dst.fileno(), src.fileno(), offset,
+                                     remaining)
+                if not copied:
+                    break
+                offset += copied
+                remaining -= copied
+    except OSError:
+        pass
+    src.seek(offset)
+    while remaining:
+        chunk = src.read(min(remaining, copy_chunk_size))
+        if not chunk:
+            break
+        dst.write(chunk)
+        remaining -= len(chunk)
+    if remaining:
+        raise ValueError('picture is truncated')
+
+
+class Picture(Mapping):
+    def __init__(self, audio_file, descriptor, offset, length):
+        self.audio_file = audio_file
+        self.descriptor = descriptor
+        self.offset = offset
+        self.length = length
+
+    def __getitem__(self, key):
+        if key == 'pic':
+            return self.data()
+        return self.descriptor[key]
+
+    def __iter__(self):
+        yield from self.descriptor
+        yield 'pic'
+
+    def __len__(self):
+        return len(self.descriptor) + 1
+
+    def __repr__(self):
+        return 'Picture({0!r}, offset={1}, length={2})'.format(
+            self.descriptor, self.offset, self.length)
+
+    def data(self):
+        return self.audio_file.read_at(self.offset, self.length)
+
+    def save(self, path):
+        filename = self.audio_file.filename
+        with open(path, 'wb') as dst:
+            if isinstance(filename, str) and os.path.isfile(filename):
+                with open(filename, 'rb') as src:
+                    copy_range(src, self.offset, self.length, dst)
+            else:
+                dst.write(self.data())
+        return path
@@ -0,0 +1,533 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import wave
+import decoder
+from flac import AudioFile
+try:
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtMultimedia import QAudioFormat, QAudioOutput
+except ImportError:
+    QAudioOutput = None
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        self.data = bytearray(capacity)
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+
+    def free(self):
+        return self.capacity - self.size
+
+    def write(self, data):
+        if len(data) > self.free():
+            raise ValueError('ring buffer overflow')
+        end = (self.start + self.size) % self.capacity
+        first = min(len(data), self.capacity - end)
+        self.data[end:end + first] = data[:first]
+        self.data[:len(data) - first] = data[first:]
+        self.size += len(data)
+
+    def read(self, size):
+        size = min(size, self.size)
+        first = min(size, self.capacity - self.start)
+        data = bytes(self.data[self.start:self.start + first]) + \
+            bytes(self.data[:size - first])
+        self.start = (self.start + size) % self.capacity
+        self.size -= size
+        return data
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+
+class Track:
+    def __init__(self, audio_file, prefetch_frames=0, cache=None):
+        if isinstance(audio_file, str):
+            audio_file = AudioFile(audio_file)
+        if not len(audio_file.frames):
+            audio_file.parse_frames(cache)
+        self.audio_file = audio_file
+        self.frames = audio_file.frames
+        info = audio_file.streaminfo
+        self.format = (info['rate'], info['channels'],
+                       info['bits per sample'])
+        self.frame_bytes = info['channels'] * \
+            ((info['bits per sample'] + 7) // 8)
+        self.block_size = max(info['block_maxsize'],
+                              max(self.frames.block_sizes, default=1))
+        self.total = info['samples in flow']
+        if not self.total and len(self.frames):
+            self.total = self.frames.first_samples[-1] + \
+                self.frames.block_sizes[-1]
+        self.prefetched = {}
+        for i in range(0, min(prefetch_frames, len(self.frames))):
+            try:
+                self.prefetched[i] = self.decode(i)
+            except ValueError:
+                break
+
+    def __len__(self):
+        return len(self.frames)
+
+    def decode(self, i):
+        if i in self.prefetched:
+            return self.prefetched.pop(i)
+        data = decoder.to_bytes(self.audio_file.decode_frame(i),
+                                self.format[2])
+        return data[:max(self.total - self.frames.first_samples[i], 0) *
+                    self.frame_bytes]
+
+    def silence(self, i):
+        return bytes(min(self.frames.block_sizes[i],
+                         self.total - self.frames.first_samples[i]) *
+                     self.frame_bytes)
+
+
+class NullSink:
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.bytes = 0
+
+    def open(self, rate, channels, sample_size):
+        self.bytes_per_second = rate * channels * ((sample_size + 7) // 8)
+        self.flush()
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.written += len(data)
+        if self.realtime:
+            delay = self.clock + self.written / self.bytes_per_second - \
+                time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def flush(self):
+        self.clock = time.perf_counter()
+        self.written = 0
+
+    def close(self):
+        pass
+
+
+class WavSink:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+
+    def open(self, rate, channels, sample_size):
+        self.width = (sample_size + 7) // 8
+        self.file = wave.open(self.filename, 'wb')
+        self.file.setnchannels(channels)
+        self.file.setsampwidth(self.width)
+        self.file.setframerate(rate)
+
+    def write(self, data):
+        if self.width == 1:
+            data = bytes((byte + 128) & 0xff for byte in data)
+        self.file.writeframes(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class DeviceSink:
+    def __init__(self, volume=1.0, interval=10):
+        if QAudioOutput is None:
+            raise ValueError('PyQt5 is required for audio output')
+        self.volume = volume
+        self.output = None
+        self.format = None
+        self.pending = b''
+        self.pipeline = None
+        self.timer = QTimer()
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.feed)
+
+    def start(self, pipeline):
+        self.pipeline = pipeline
+        self.generation = pipeline.generation
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.close()
+
+    def open(self, rate, channels, sample_size):
+        audio_format = QAudioFormat()
+        audio_format.setSampleRate(rate)
+        audio_format.setChannelCount(channels)
+        audio_format.setSampleSize(8 * ((sample_size + 7) // 8))
+        audio_format.setCodec('audio/pcm')
+        audio_format.setByteOrder(QAudioFormat.LittleEndian)
+        audio_format.setSampleType(QAudioFormat.SignedInt)
+        self.output = QAudioOutput(audio_format)
+        self.output.setVolume(self.volume)
+        self.device = self.output.start()
+        self.format = (rate, channels, sample_size)
+
+    def feed(self):
+        if self.generation != self.pipeline.generation:
+            self.generation = self.pipeline.generation
+            self.pending = b''
+            if self.output is not None:
+                self.output.reset()
+                self.device = self.output.start()
+        if self.output is not None and self.output.volume() != self.volume:
+            self.output.setVolume(self.volume)
+        while True:
+            if not self.pending:
+                size = self.output.bytesFree() if self.output else 4096
+                self.pending, audio_format = self.pipeline.pull(size)
+                if not self.pending:
+                    return
+                if audio_format != self.format:
+                    self.close()
+                    self.open(*audio_format)
+            written = self.device.write(self.pending)
+            if written <= 0:
+                return
+            self.pending = self.pending[written:]
+
+    def close(self):
+        if self.output is not None:
+            self.output.stop()
+            self.output = None
+            self.format = None
+
+
+class Pipeline:
+    def __init__(self, audio_file, sink, buffer_seconds=1.0,
+                 period_seconds=0.02, playlist=(), prefetch_frames=4,
+                 cache=None):
+        self.tracks = [audio_file] + list(playlist)
+        self.sink = sink
+        self.buffer_seconds = buffer_seconds
+        self.period_seconds = period_seconds
+        self.prefetch_frames = prefetch_frames
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.prepared = {}
+        self.buffer = RingBuffer(0)
+        self.boundaries = deque()
+        self.written = 0
+        self.consumed = 0
+        self.condition = threading.Condition()
+        self.finished = threading.Event()
+        self.threads = []
+        self.generation = 0
+        self.decoding = None
+        self.decode_track = 0
+        self.next_frame = 0
+        self.skip = 0
+        self.start = 0
+        self.decoded_all = False
+        self.filling = True
+        self.stopping = False
+        self.paused = False
+        self.requested = None
+        self.current = None
+        self.track = None
+        self.audio_file = None
+        self.total = 0
+        self.position = 0
+        self.stats = {'startup latency': None,
+                      'seek latency': None,
+                      'underruns': 0,
+                      'decode errors': 0,
+                      'failed tracks': 0,
+                      'frames decoded': 0,
+                      'bytes played': 0}
+        self.__prepare(0)
+
+    def __switch(self, track, index, position):
+        self.current = track
+        self.track = index
+        self.audio_file = track.audio_file
+        self.frames = track.frames
+        self.rate, self.channels, self.sample_size = track.format
+        self.frame_bytes = track.frame_bytes
+        self.total = track.total
+        self.period = self.frame_bytes * max(
+            1, round(self.period_seconds * self.rate))
+        self.position = position
+        for i in list(self.prepared):
+            if i <= index:
+                del self.prepared[i]
+
+    def opened(self, index=0):
+        future = self.prepared.get(index)
+        if future is None or not future.done():
+            return None
+        try:
+            return future.result()
+        except (OSError, ValueError):
+            return False
+
+    def state(self):
+        if self.paused:
+            return 'paused'
+        if self.threads and not self.finished.is_set():
+            return 'playing'
+        return 'stopped'
+
+    def play(self):
+        with self.condition:
+            if self.paused:
+                self.paused = False
+                self.condition.notify_all()
+                return
+            if self.threads and not self.finished.is_set():
+                return
+        if self.threads:
+            self.stop()
+            self.stopping = False
+            self.finished.clear()
+            if self.decode_track >= len(self.tracks) and \
+                    self.current is not None:
+                self.seek(self.position if self.position < self.total else 0)
+        self.requested = time.perf_counter()
+        self.threads = [threading.Thread(target=self.__decode, daemon=True)]
+        if not hasattr(self.sink, 'start'):
+            self.threads.append(threading.Thread(target=self.__output,
+                                                 daemon=True))
+        for thread in self.threads:
+            thread.start()
+        if hasattr(self.sink, 'start'):
+            self.sink.start(self)
+
+    def pause(self):
+        with self.condition:
+            self.paused = self.paused or self.state() == 'playing'
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.paused = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        if hasattr(self.sink, 'start'):
+            self.sink.stop()
+        self.finished.set()
+
+    def close(self):
+        self.stop()
+        self.executor.shutdown(wait=False)
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def __flush(self):
+        self.generation += 1
+        self.buffer.clear()
+        self.boundaries.clear()
+        self.written = 0
+        self.consumed = 0
+        self.next_frame = 0
+        self.skip = 0
+        self.start = 0
+        self.decoded_all = False
+        self.filling = True
+        self.requested = time.perf_counter()
+
+    def seek(self, sample):
+        with self.condition:
+            if self.current is None:
+                self.start = max(sample, 0)
+                return
+            sample = max(0, min(sample, self.total - 1))
+            i = self.frames.frame_for_sample(sample)
+            self.__flush()
+            self.decoding = self.current
+            self.decode_track = self.track
+            self.next_frame = i
+            self.skip = sample - self.frames.first_samples[i]
+            self.position = sample
+            self.condition.notify_all()
+
+    def jump(self, index):
+        with self.condition:
+            if not 0 <= index < len(self.tracks):
+                return
+            self.__flush()
+            self.decoding = None
+            self.decode_track = index
+            self.condition.notify_all()
+
+    def set_volume(self, volume):
+        self.sink.volume = volume
+
+    def __prepare(self, index):
+        if index >= len(self.tracks) or index in self.prepared:
+            return
+        entry = self.tracks[index]
+        if isinstance(entry, Track):
+            self.prepared[index] = self.executor.submit(lambda: entry)
+        else:
+            self.prepared[index] = self.executor.submit(
+                Track, entry, self.prefetch_frames, self.cache)
+
+    def __open(self, generation, index):
+        with self.condition:
+            self.__prepare(index)
+            future = self.prepared[index]
+        try:
+            track = future.result()
+        except (OSError, ValueError):
+            track = None
+        with self.condition:
+            if generation != self.generation:
+                return
+            if track is None:
+                self.stats['failed tracks'] += 1
+                self.decode_track = index + 1
+                return
+            if not self.buffer.capacity:
+                self.buffer = RingBuffer(track.frame_bytes * max(
+                    round(self.buffer_seconds * track.format[0]),
+                    2 * track.block_size))
+            start = min(self.start, max(track.total - 1, 0))
+            if start:
+                self.next_frame = track.frames.frame_for_sample(start)
+                self.skip = start - track.frames.first_samples[self.next_frame]
+                self.start = 0
+            self.decoding = track
+            self.boundaries.append((self.written, track, index, start))
+            self.condition.notify_all()
+
+    def __decode(self):
+        while True:
+            with self.condition:
+                while not self.stopping and (
+                        self.decoded_all or self.decoding is not None and
+                        not self.buffer.free()):
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                generation, track, i, skip = self.generation, \
+                    self.decoding, self.next_frame, self.skip
+                index = self.decode_track
+                if track is not None and (
+                        i >= len(track) or
+                        track.frames.first_samples[i] >= track.total):
+                    self.decoding = track = None
+                    self.decode_track = index = index + 1
+                    self.next_frame = 0
+                if track is None and index >= len(self.tracks):
+                    self.decoded_all = True
+                    self.condition.notify_all()
+                    continue
+                self.__prepare(index + 1)
+            if track is None:
+                self.__open(generation, index)
+                continue
+            try:
+                data = track.decode(i)
+                decoded = 1
+            except ValueError:
+                data = track.silence(i)
+                decoded = 0
+                self.stats['decode errors'] += 1
+            data = memoryview(data)[skip * track.frame_bytes:]
+            with self.condition:
+                while data:
+                    while not self.stopping and \
+                            generation == self.generation and \
+                            not self.buffer.free():
+                        self.condition.wait()
+                    if self.stopping or generation != self.generation:
+                        break
+                    size = min(len(data), self.buffer.free())
+                    self.buffer.write(data[:size])
+                    self.written += size
+                    data = data[size:]
+                    self.condition.notify_all()
+                else:
+                    self.next_frame = i + 1
+                    self.skip = 0
+                    self.stats['frames decoded'] += decoded
+
+    def __take(self, size, wait):
+        while True:
+            while self.__boundary():
+                offset, track, index, start = self.boundaries.popleft()
+                self.__switch(track, index, start)
+            if self.stopping:
+                return None
+            if self.paused or not self.buffer.size and not self.decoded_all:
+                if not self.paused and not self.filling:
+                    self.stats['underruns'] += 1
+                    self.filling = True
+                if not wait:
+                    return b''
+                self.condition.wait()
+                continue
+            if not self.buffer.size:
+                self.finished.set()
+                return None
+            size = size or self.period
+            if self.boundaries:
+                size = min(size, self.boundaries[0][0] - self.consumed)
+            data = self.buffer.read(size - size % self.frame_bytes)
+            self.consumed += len(data)
+            self.condition.notify_all()
+            return data
+
+    def __played(self, data):
+        self.position += len(data) // self.frame_bytes
+        self.stats['bytes played'] += len(data)
+        self.filling = False
+        if self.requested is not None:
+            latency = time.perf_counter() - self.requested
+            key = 'seek latency' \
+                if self.stats['startup latency'] is not None \
+                else 'startup latency'
+            self.stats[key] = latency
+            self.requested = None
+
+    def pull(self, size):
+        with self.condition:
+            data = self.__take(size, False)
+            if not data:
+                return b'', None
+            self.__played(data)
+            return data, self.current.format
+
+    def __output(self):
+        sink_format = None
+        try:
+            while True:
+                with self.condition:
+                    data = self.__take(None, True)
+                    if data is None:
+                        return
+                    generation = self.generation
+                    track_format = self.current.format
+                if track_format != sink_format:
+                    if sink_format is not None:
+                        self.sink.close()
+                    sink_format = track_format
+                    self.sink.open(*sink_format)
+                if self.requested is not None:
+                    self.sink.flush()
+                self.sink.write(data)
+                with self.condition:
+                    if generation == self.generation:
+                        self.__played(data)
+        finally:
+            self.sink.close()
+
+    def __boundary(self):
+        return self.boundaries and self.boundaries[0][0] == self.consumed
@@ -1,9 +1,15 @@
 from argparse import ArgumentParser
+import queue
 import sys
+import threading
 import re
-from PyQt5.QtCore import QUrl, Qt, QCoreApplication
+from PyQt5.QtCore import QUrl, Qt, QCoreApplication, QTimer
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
+import constants
 from flac import AudioFile
+from frame_cache import FrameCache
+import playback
+import report
 volume_regex = re.compile(r'v (\d+)')
 position_regex = re.compile(r'p ([-+])(\d+)')
 
@@ -14,36 +20,186 @@ class Player:
             ArgumentParser(description='flac player',
                            usage="""python player_cli.py -f [filename]
         use flag -p --picture to save picture from file to current directory
-        use flag -fr --frames to save frames info
+        use flag -fr --frames [text|csv|jsonl|binary] to save frames info
+        use flag -fo --frames-output to choose the report path, - for stdout
+        use flag -vf --verify to check frame CRCs and the MD5 signature
+        use flag -pr --profile [FILE] to write per-stage timings as JSON
+        use flag -s --sink device|null|wav to play through own decoder
+        use flag -so --sink-output to choose the wav sink path
+        use flag -pl --playlist [FILE ...] to queue files for gapless playing
         use commands pl an pa during playing for play and pause
         use command v [int] to set volume
-        use command p [int] for rewinding""")
+        use command p [int] for rewinding
+        use commands next and prev to switch tracks of the playlist""")
         self.parser.add_argument('-f', '--filename', dest='filename',
                                  action='store', required=True,
-                                 help='Input path to the flac file',
+                                 help='Input path to the flac file, '
+                                      '- for stdin',
                                  metavar='FILE')
         self.parser.add_argument('-p', '--picture', help="Save picture",
                                  action='store_true', required=False)
         self.parser.add_argument('-fr', '--frames', help="Save frames info",
+                                 nargs='?', const='text', required=False,
+                                 choices=sorted(report.reports))
+        self.parser.add_argument('-fo', '--frames-output',
+                                 help="Frames info path, - for stdout",
+                                 required=False, metavar='PATH')
+        self.parser.add_argument('-vf', '--verify',
+                                 help="Verify file integrity and exit",
                                  action='store_true', required=False)
+        self.parser.add_argument('-pr', '--profile',
+                                 help="Write per-stage profiling JSON, "
+                                      "stderr by default",
+                                 nargs='?', const='-', required=False,
+                                 metavar='FILE')
+        self.parser.add_argument('-s', '--sink',
+                                 help="Decode and play through the pipeline",
+                                 choices=['device', 'null', 'wav'],
+                                 required=False)
+        self.parser.add_argument('-so', '--sink-output',
+                                 help="Path for the wav sink",
+                                 default='output.wav', required=False,
+                                 metavar='FILE')
+        self.parser.add_argument('-pl', '--playlist',
+                                 help="Files to play after FILE without gaps",
+                                 nargs='+', default=[], required=False,
+                                 metavar='FILE')
         self.args = self.parser.parse_args()
-        self.file = AudioFile(self.args.filename)
+        stdin = self.args.filename == '-'
+        if stdin and (self.args.sink or self.args.playlist or
+                      self.args.picture or
+                      not (self.args.verify or self.args.frames)):
+            self.parser.error('-f - works only with --verify or --frames')
+        if self.args.playlist and not self.args.sink:
+            self.args.sink = 'device'
+        source = sys.stdin.buffer if stdin else self.args.filename
+        self.file = AudioFile(source,
+                              profile=self.args.profile is not None)
+        if self.args.verify:
+            self.verify()
+        if stdin:
+            self.save_frames(self.args.frames_output or '-')
+            self.profile()
+            sys.exit(0)
         if self.args.picture:
             self.file.save_picture()
+        if self.args.sink:
+            self.play_pipeline()
+            return
         self.player = QMediaPlayer()
         self.position = 0
         self.player.\
             setMedia(QMediaContent(QUrl.fromLocalFile(self.file.filename)))
         print(self.file.make_text())
         if self.args.frames:
-            self.file.parse_frames()
-            self.file.save_frames_text()
+            self.save_frames(self.args.frames_output)
+        self.profile()
 
         self.player.play()
         self.player.stateChanged.connect(self.mediaStateChanged)
 
         self.play()
 
+    def save_frames(self, path):
+        self.file.parse_frames(FrameCache())
+        self.file.save_frames_report(self.args.frames, path)
+
+    def verify(self):
+        report = self.file.verify()
+        print(constants.verify_text.format(
+            report['frames'], report['samples'],
+            self.file.streaminfo['samples in flow'],
+            report['crc failures'] or 'none',
+            report['decode failures'] or 'none',
+            constants.md5_text[report['md5 ok']]))
+        failed = report['crc failures'] or report['decode failures'] or \
+            report['md5 ok'] is False or \
+            report['samples'] != self.file.streaminfo['samples in flow']
+        self.profile()
+        sys.exit(1 if failed else 0)
+
+    def profile(self):
+        if self.args.profile is None:
+            return
+        text = self.file.stats.to_json(indent=2)
+        if self.args.profile == '-':
+            sys.stderr.write(text + '\n')
+        else:
+            with open(self.args.profile, 'w') as f:
+                f.write(text)
+
+    def play_pipeline(self):
+        print(self.file.make_text())
+        if self.args.sink == 'device':
+            sink = playback.DeviceSink()
+        elif self.args.sink == 'wav':
+            sink = playback.WavSink(self.args.sink_output)
+        else:
+            sink = playback.NullSink(realtime=False)
+        if self.args.frames:
+            self.save_frames(self.args.frames_output)
+        self.pipeline = playback.Pipeline(self.file, sink,
+                                          playlist=self.args.playlist)
+        self.profile()
+        self.pipeline.play()
+        if self.args.sink != 'device':
+            self.pipeline.wait()
+            self.finish_pipeline()
+        self.commands = queue.Queue()
+        threading.Thread(target=self.read_commands, daemon=True).start()
+        self.timer = QTimer()
+        self.timer.setInterval(50)
+        self.timer.timeout.connect(self.poll_pipeline)
+        self.timer.start()
+
+    def finish_pipeline(self):
+        self.pipeline.close()
+        stats = self.pipeline.stats
+        print(constants.playback_text.format(
+            1000 * (stats['startup latency'] or 0),
+            '{0:.1f} ms'.format(1000 * stats['seek latency'])
+            if stats['seek latency'] is not None else 'none',
+            stats['underruns'], stats['frames decoded'],
+            stats['decode errors']))
+        if self.args.sink == 'device':
+            QCoreApplication.exit(0)
+        else:
+            sys.exit(0)
+
+    def read_commands(self):
+        while True:
+            self.commands.put(input())
+
+    def poll_pipeline(self):
+        while self.pipeline.current is not None and \
+                not self.commands.empty():
+            self.pipeline_command(self.commands.get())
+        if self.pipeline.finished.is_set():
+            self.timer.stop()
+            self.finish_pipeline()
+
+    def pipeline_command(self, line):
+        volume = volume_regex.match(line)
+        position = position_regex.match(line)
+        if line == 'pa':
+            self.pipeline.pause()
+        if line == 'pl':
+            self.pipeline.play()
+        if line == 'stop':
+            self.pipeline.finished.set()
+        if line == 'next':
+            self.pipeline.jump(self.pipeline.track + 1)
+        if line == 'prev':
+            self.pipeline.jump(self.pipeline.track - 1)
+        if volume:
+            self.pipeline.set_volume(int(volume.group(1)) / 100)
+        if position:
+            pos = int(position.group(2))
+            if position.group(1) == '-':
+                pos = -pos
+            self.pipeline.seek(self.pipeline.position +
+                               pos * self.pipeline.rate // 10)
+
     def play(self):
         while True:
             line = input()
@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 
+import os
 import sys
-from PyQt5.QtCore import QDir, Qt, QUrl, QByteArray
-from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
+import threading
+from PyQt5.QtCore import QDir, Qt, QTimer, QByteArray
 from PyQt5.QtWidgets import (QApplication, QFileDialog, QHBoxLayout, QLabel,
-                             QPushButton, QSizePolicy, QSlider, QStyle,
-                             QVBoxLayout, QWidget)
+                             QListWidget, QPushButton, QSizePolicy, QSlider,
+                             QStyle, QVBoxLayout, QWidget)
 from PyQt5.QtWidgets import QMainWindow, QWidget, QPushButton, QAction
-from PyQt5.QtGui import QIcon, QPixmap, QGuiApplication
-from flac import AudioFile
+from PyQt5.QtGui import QColor, QIcon, QPainter, QPixmap, QGuiApplication
+from frame_cache import FrameCache
+import playback
+import waveform
 
 
 class AudioWindow(QMainWindow):
@@ -17,8 +20,12 @@ class AudioWindow(QMainWindow):
         super(AudioWindow, self).__init__(parent)
         self.setWindowTitle("Flac player")
 
-        self.mediaPlayer = QMediaPlayer()
+        self.pipeline = None
         self.file_info = None
+        self.track = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(100)
+        self.timer.timeout.connect(self.updateState)
 
         self.playButton = QPushButton()
         self.playButton.setEnabled(False)
@@ -28,11 +35,15 @@ class AudioWindow(QMainWindow):
         self.volumeSlider = QSlider(Qt.Vertical)
         self.volumeSlider.setRange(0, 0)
         self.volumeSlider.setValue(100)
-        self.positionSlider = QSlider(Qt.Horizontal)
+        self.positionSlider = WaveformSlider()
+        self.peaksGeneration = 0
         self.positionSlider.setRange(0, 0)
         self.positionSlider.sliderMoved.connect(self.setPosition)
         self.volumeSlider.sliderMoved.connect(self.setVolume)
 
+        self.playlist = QListWidget()
+        self.playlist.itemDoubleClicked.connect(self.jump)
+
         self.errorLabel = QLabel()
         self.errorLabel.setSizePolicy(QSizePolicy.Preferred,
                                       QSizePolicy.Maximum)
@@ -42,7 +53,7 @@ class AudioWindow(QMainWindow):
         # Create new action
         openAction = QAction(QIcon('open.png'), '&Open', self)
         openAction.setShortcut('Ctrl+O')
-        openAction.setStatusTip('Open flac file')
+        openAction.setStatusTip('Open flac files as a playlist')
         openAction.triggered.connect(self.openFile)
 
         # Create exit action
@@ -76,80 +87,167 @@ class AudioWindow(QMainWindow):
 
         layout = QVBoxLayout()
         layout.addLayout(controlLayout)
+        layout.addWidget(self.playlist)
         layout.addWidget(self.errorLabel)
 
         # Set widget to contain window contents
         wid.setLayout(layout)
 
-        self.mediaPlayer.stateChanged.connect(self.mediaStateChanged)
-        self.mediaPlayer.positionChanged.connect(self.positionChanged)
-        self.mediaPlayer.durationChanged.connect(self.durationChanged)
-        self.mediaPlayer.volumeChanged.connect(self.volumeChanged)
-        self.mediaPlayer.error.connect(self.handleError)
-
     def openFile(self):
-        fileName, _ = QFileDialog.getOpenFileName(self, "Open flac file",
-                                                  QDir.homePath())
-        if fileName != '':
-            try:
-                    self.file_info = AudioFile(fileName)
-
-            except ValueError:
-                self.infoAction.setEnabled(False)
-                self.errorLabel.setText('Error: file is not flac')
-                self.mediaPlayer.setMedia(QMediaContent())
-                self.playButton.setEnabled(False)
-                self.volumeSlider.setRange(0, 0)
-            else:
-                self.infoAction.setEnabled(True)
-                self.volumeSlider.setRange(0, 100)
-                self.volumeSlider.setValue(100)
-                self.mediaPlayer.setMedia(
-                    QMediaContent(QUrl.fromLocalFile(fileName)))
-                self.errorLabel.setText('')
-                self.playButton.setEnabled(True)
+        fileNames, _ = QFileDialog.getOpenFileNames(self, "Open flac files",
+                                                    QDir.homePath())
+        if fileNames:
+            self.closePipeline()
+            self.playlist.clear()
+            self.file_info = None
+            self.infoAction.setEnabled(False)
+            self.positionSlider.setRange(0, 0)
+            self.pipeline = playback.Pipeline(
+                fileNames[0], playback.DeviceSink(), playlist=fileNames[1:],
+                cache=FrameCache())
+            self.volumeSlider.setRange(0, 100)
+            self.volumeSlider.setValue(100)
+            self.playlist.addItems(
+                [os.path.basename(name) for name in fileNames])
+            self.track = None
+            self.errorLabel.setText('Opening...')
+            self.playButton.setEnabled(False)
+            self.timer.start()
 
     def exitCall(self):
+        self.closePipeline()
         sys.exit(app.exec_())
 
+    def closeEvent(self, event):
+        self.closePipeline()
+        super(AudioWindow, self).closeEvent(event)
+
+    def closePipeline(self):
+        self.peaksGeneration += 1
+        self.positionSlider.setPeaks(None)
+        self.timer.stop()
+        if self.pipeline:
+            self.pipeline.close()
+            self.pipeline = None
+
     def play(self):
-        if self.mediaPlayer.state() == QMediaPlayer.PlayingState:
-            self.mediaPlayer.pause()
+        if self.pipeline.state() == 'playing':
+            self.pipeline.pause()
         else:
-            self.mediaPlayer.play()
-
-    def mediaStateChanged(self, state):
-        if self.mediaPlayer.state() == QMediaPlayer.PlayingState:
+            self.pipeline.play()
+        self.updateState()
+
+    def updateState(self):
+        if not self.pipeline:
+            return
+        index, track = self.pipeline.track, self.pipeline.current
+        if track is None:
+            index, track = 0, self.pipeline.opened(0)
+            if track is None:
+                return
+            if track is False:
+                self.timer.stop()
+                self.errorLabel.setText('Error: file is not flac')
+                self.volumeSlider.setRange(0, 0)
+                return
+        if index != self.track:
+            self.track = index
+            self.file_info = track.audio_file
+            self.infoAction.setEnabled(True)
+            self.errorLabel.setText('')
+            self.playButton.setEnabled(True)
+            self.playlist.setCurrentRow(self.track)
+            self.positionSlider.setRange(
+                0, track.total * 1000 // track.format[0])
+            self.loadPeaks(self.file_info)
+        self.positionSlider.refresh()
+        if self.pipeline.state() == 'playing':
             self.playButton.setIcon(
                     self.style().standardIcon(QStyle.SP_MediaPause))
         else:
             self.playButton.setIcon(
                     self.style().standardIcon(QStyle.SP_MediaPlay))
-
-    def positionChanged(self, position):
-        self.positionSlider.setValue(position)
-
-    def durationChanged(self, duration):
-        self.positionSlider.setRange(0, duration)
-
-    def volumeChanged(self, volume):
-        self.volumeSlider.setValue(volume)
+        if not self.positionSlider.isSliderDown():
+            self.positionSlider.setValue(
+                self.pipeline.position * 1000 // track.format[0])
+
+    def loadPeaks(self, audio_file):
+        self.peaksGeneration += 1
+        generation = self.peaksGeneration
+        peaks = waveform.Peaks(waveform.total_samples(audio_file))
+        self.positionSlider.setPeaks(peaks)
+        threading.Thread(target=self.computePeaks,
+                         args=(audio_file, peaks,
+                               lambda: generation != self.peaksGeneration),
+                         daemon=True).start()
+
+    def computePeaks(self, audio_file, peaks, cancelled):
+        try:
+            result = waveform.load_or_compute(audio_file, peaks=peaks,
+                                              cancelled=cancelled)
+        except (OSError, ValueError):
+            return
+        if not cancelled():
+            self.positionSlider.peaks = result
+
+    def jump(self, item):
+        self.pipeline.jump(self.playlist.row(item))
+        self.pipeline.play()
 
     def setPosition(self, position):
-        self.mediaPlayer.setPosition(position)
+        if self.pipeline.current is not None:
+            self.pipeline.seek(position * self.pipeline.rate // 1000)
 
     def setVolume(self, volume):
-        self.mediaPlayer.setVolume(volume)
-
-    def handleError(self):
-        self.playButton.setEnabled(False)
-        self.errorLabel.setText("Error: " + self.mediaPlayer.errorString())
+        self.pipeline.set_volume(volume / 100)
 
     def showInfo(self):
         self.info_window = InfoWindow(self.file_info)
         self.info_window.show()
 
 
+class WaveformSlider(QSlider):
+    def __init__(self, parent=None):
+        super(WaveformSlider, self).__init__(Qt.Horizontal, parent)
+        self.setMinimumHeight(60)
+        self.peaks = None
+        self.painted = None
+        self.cached = None
+
+    def setPeaks(self, peaks):
+        self.peaks = peaks
+        self.update()
+
+    def refresh(self):
+        if self.peaks is not None and \
+                (self.peaks, self.peaks.computed) != self.painted:
+            self.update()
+
+    def paintEvent(self, event):
+        peaks = self.peaks
+        if peaks is not None and len(peaks):
+            key = (peaks, peaks.computed, peaks.complete, self.width())
+            if self.cached is None or self.cached[0] != key:
+                self.cached = (key, peaks.columns(self.width()))
+            columns = self.cached[1]
+            self.painted = (peaks, peaks.computed)
+            painter = QPainter(self)
+            middle = self.height() / 2
+            ratio = middle / 32768
+            step = self.width() / len(columns)
+            for x, (low, high, rms) in enumerate(columns):
+                painter.fillRect(round(x * step), round(middle - high * ratio),
+                                 max(1, round(step)),
+                                 max(1, round((high - low) * ratio)),
+                                 QColor(150, 180, 220))
+                painter.fillRect(round(x * step), round(middle - rms * ratio),
+                                 max(1, round(step)),
+                                 max(1, round(2 * rms * ratio)),
+                                 QColor(60, 100, 160))
+            painter.end()
+        super(WaveformSlider, self).paintEvent(event)
+
+
 class InfoWindow(QWidget):
     def __init__(self, file_info):
         super().__init__()
@@ -165,7 +263,8 @@ class InfoWindow(QWidget):
             self.saveFramesButton.clicked.connect(self.save_frames_info)
             if self.file_info.picture:
                 self.saveButton.setEnabled(True)
-                self.saveButton.clicked.connect(self.file_info.save_picture)
+                self.saveButton.clicked.connect(
+                    lambda: self.file_info.save_picture())
         layout.addWidget(infoLabel)
         layout.addWidget(self.saveButton)
         layout.addWidget(self.saveFramesButton)
@@ -179,8 +278,16 @@ class InfoWindow(QWidget):
         return text
 
     def save_frames_info(self):
-        self.file_info.parse_frames()
-        self.file_info.save_frames_text()
+        filters = {'Text (*.txt)': 'text', 'CSV (*.csv)': 'csv',
+                   'JSON lines (*.jsonl)': 'jsonl', 'Binary (*.bin)': 'binary'}
+        path, selected = QFileDialog.getSaveFileName(
+            self, 'Save frames info',
+            os.path.splitext(self.file_info.filename)[0] + ' frames.txt',
+            ';;'.join(filters))
+        if not path:
+            return
+        self.file_info.parse_frames(FrameCache())
+        self.file_info.save_frames_report(filters[selected], path)
 
 
 if __name__ == '__main__':
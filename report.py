@@ -0,0 +1,141 @@
+import csv
+import json
+import struct
+import sys
+import constants
+
+fields = ('offset', 'block size', 'sample rate', 'channels', 'sample size',
+          'sample number', 'crc ok')
+binary_header = struct.Struct('<4sH')
+binary_row = struct.Struct('<qLQdBB?')
+binary_magic = b'FLFR'
+binary_version = 1
+binary_chunk_rows = 4096
+
+
+class TextReport:
+    binary = False
+
+    def __init__(self, f, sample_numbers):
+        self.f = f
+        self.sample_numbers = sample_numbers
+
+    def write(self, i, frame):
+        text = constants.frames_text.format(i,
+                                            frame['offset'],
+                                            frame['block size'],
+                                            frame['sample rate'],
+                                            frame['channels'],
+                                            frame['sample size'])
+        if self.sample_numbers:
+            text += constants.sample_number_text.format(frame
+                                                        ['sample number'])
+        self.f.write(text + '\n\n')
+
+
+class CsvReport:
+    binary = False
+
+    def __init__(self, f, sample_numbers):
+        self.writer = csv.writer(f)
+        self.writer.writerow(('frame',) + fields)
+
+    def write(self, i, frame):
+        self.writer.writerow([i] + [frame[field] for field in fields])
+
+
+class JsonlReport:
+    binary = False
+
+    def __init__(self, f, sample_numbers):
+        self.f = f
+
+    def write(self, i, frame):
+        row = {'frame': i}
+        row.update((field, frame[field]) for field in fields)
+        self.f.write(json.dumps(row) + '\n')
+
+
+class BinaryReport:
+    binary = True
+
+    def __init__(self, f, sample_numbers):
+        self.f = f
+        self.f.write(binary_header.pack(binary_magic, binary_version))
+
+    def write(self, i, frame):
+        channels = frame['channels']
+        if isinstance(channels, str):
+            channels = constants.channel_codes[channels]
+        else:
+            channels -= 1
+        self.f.write(binary_row.pack(frame['offset'], frame['block size'],
+                                     frame['sample number'],
+                                     frame['sample rate'], channels,
+                                     frame['sample size'], frame['crc ok']))
+
+
+reports = {'text': TextReport,
+           'csv': CsvReport,
+           'jsonl': JsonlReport,
+           'binary': BinaryReport}
+extensions = {'text': '.txt', 'csv': '.csv', 'jsonl': '.jsonl',
+              'binary': '.bin'}
+
+
+def read_binary(f):
+    magic, version = binary_header.unpack(f.read(binary_header.size))
+    if magic != binary_magic or version != binary_version:
+        raise ValueError('not a binary frame report')
+    rest = b''
+    while True:
+        data = f.read(binary_chunk_rows * binary_row.size)
+        if not data:
+            if rest:
+                raise ValueError('truncated binary frame report')
+            return
+        chunk = rest + data
+        end = len(chunk) - len(chunk) % binary_row.size
+        rest = chunk[end:]
+        for row in binary_row.iter_unpack(chunk[:end]):
+            offset, block_size, number, rate, channels, sample_size, \
+                crc_ok = row
+            yield {'offset': offset,
+                   'block size': block_size,
+                   'sample rate': rate,
+                   'channels': channels + 1 if channels <= 7
+                   else constants.channels[channels],
+                   'sample size': sample_size,
+                   'sample number': number,
+                   'crc ok': crc_ok}
+
+
+def frame_rows(audio_file):
+    frames = audio_file.frames
+    if not len(frames):
+        yield from enumerate(audio_file.iter_frames())
+        return
+    for i, frame in enumerate(frames):
+        frame['crc ok'] = bool(frames.crc_ok[i])
+        yield i, frame
+
+
+def write_report(audio_file, f, format='text'):
+    report = reports[format](f, audio_file.blocking_strategy)
+    for i, frame in frame_rows(audio_file):
+        report.write(i, frame)
+
+
+def save_report(audio_file, path, format='text'):
+    if format not in reports:
+        raise ValueError('unknown report format: ' + format)
+    binary = reports[format].binary
+    if path == '-':
+        f = sys.stdout.buffer if binary else sys.stdout
+        write_report(audio_file, f, format)
+        f.flush()
+        return path
+    with open(path, 'wb' if binary else 'w',
+              **({} if binary else {'newline': ''})) as f:
+        write_report(audio_file, f, format)
+    return path
@@ -0,0 +1,155 @@
+from argparse import ArgumentParser
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from functools import partial
+import hashlib
+import json
+import os
+import sys
+import time
+from flac import AudioFile, placeholder_point
+
+
+def find_files(paths, extensions):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for directory, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if name.lower().endswith(extensions):
+                    yield os.path.join(directory, name)
+
+
+def describe(audio_file, pictures_directory=None):
+    tags = dict(audio_file.tags or {})
+    vendor = tags.pop('vendor', None)
+    points = [point for point in audio_file.seektable
+              if point['first sample'] != placeholder_point]
+    record = {'streaminfo': audio_file.streaminfo,
+              'md5': audio_file.md5.hex(),
+              'first frame': audio_file.first_frame,
+              'vendor': vendor,
+              'tags': {name: sorted(values) for name, values in tags.items()},
+              'pictures': [dict(picture.descriptor, length=picture.length)
+                           for picture in audio_file.picture],
+              'cuesheet': audio_file.cuesheet or None,
+              'seektable': {'points': len(points),
+                            'placeholders':
+                                len(audio_file.seektable) - len(points)}}
+    if pictures_directory is not None:
+        name = os.path.splitext(os.path.basename(audio_file.filename))[0]
+        digest = hashlib.sha1(os.path.abspath(audio_file.filename).encode(
+            'utf-8', 'surrogateescape')).hexdigest()[:12]
+        for i, picture in enumerate(audio_file.picture):
+            record['pictures'][i]['file'] = picture.save(os.path.join(
+                pictures_directory, '{0}.{1}.{2}.{3}'.format(
+                    name, digest, i, picture['extension'])))
+    if points:
+        record['seektable']['first sample'] = points[0]['first sample']
+        record['seektable']['last sample'] = points[-1]['first sample']
+    return record
+
+
+def scan_file(path, pictures_directory=None):
+    stat = None
+    try:
+        stat = os.stat(path)
+        with AudioFile(path, lazy=True) as audio_file:
+            record = describe(audio_file, pictures_directory)
+    except Exception as e:
+        return None, {'path': path, 'size': stat.st_size if stat else None,
+                      'mtime': stat.st_mtime if stat else None,
+                      'error': type(e).__name__,
+                      'message': str(e)}
+    record = dict({'path': path, 'size': stat.st_size,
+                   'mtime': stat.st_mtime}, **record)
+    return record, None
+
+
+def iter_scan(paths, jobs=None, processes=False, worker=scan_file):
+    jobs = jobs or os.cpu_count() or 1
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    pending = set()
+    with executor_class(jobs) as executor:
+        for path in paths:
+            if len(pending) >= jobs * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(worker, path))
+        for future in wait(pending)[0]:
+            yield future.result()
+
+
+def scan(paths, output, errors, jobs=None, processes=False,
+         extensions=('.flac',), progress=None, pictures_directory=None):
+    stats = {'files': 0, 'errors': 0, 'bytes': 0}
+    start = time.perf_counter()
+    worker = scan_file
+    if pictures_directory is not None:
+        os.makedirs(pictures_directory, exist_ok=True)
+        worker = partial(scan_file, pictures_directory=pictures_directory)
+    for record, error in iter_scan(find_files(paths, extensions), jobs,
+                                   processes, worker):
+        stats['files'] += 1
+        if error:
+            stats['errors'] += 1
+            errors.write(json.dumps(error, ensure_ascii=False) + '\n')
+        else:
+            stats['bytes'] += record['size']
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if progress and stats['files'] % progress == 0:
+            report_progress(stats, time.perf_counter() - start)
+    stats['seconds'] = time.perf_counter() - start
+    stats['files per second'] = stats['files'] / (stats['seconds'] or 1e-9)
+    return stats
+
+
+def report_progress(stats, seconds):
+    sys.stderr.write('\rscanned {0} files, {1} errors, {2:.1f} files/s'
+                     .format(stats['files'], stats['errors'],
+                             stats['files'] / (seconds or 1e-9)))
+    sys.stderr.flush()
+
+
+def main():
+    parser = ArgumentParser(description='flac library scanner',
+                            usage="""python scanner.py [paths]
+        use flag -o --output to write metadata lines to a file
+        use flag -e --errors to write per-file errors to a file
+        use flag -j --jobs to set the number of workers
+        use flag -p --processes to use processes instead of threads
+        use flag -x --export-pictures to save all pictures to a directory""")
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='Directories or files to scan')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='JSON lines output, stdout by default')
+    parser.add_argument('-e', '--errors', metavar='FILE',
+                        help='JSON lines errors, stderr by default')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of concurrent workers')
+    parser.add_argument('-p', '--processes', action='store_true',
+                        help='Use a process pool')
+    parser.add_argument('-x', '--export-pictures', metavar='DIRECTORY',
+                        help='Save every picture to a directory')
+    parser.add_argument('--progress', type=int, default=1000,
+                        metavar='N', help='Report progress every N files')
+    args = parser.parse_args()
+    output = open(args.output, 'w') if args.output else sys.stdout
+    errors = open(args.errors, 'w') if args.errors else sys.stderr
+    try:
+        stats = scan(args.paths, output, errors, args.jobs, args.processes,
+                     progress=args.progress,
+                     pictures_directory=args.export_pictures)
+    finally:
+        if args.output:
+            output.close()
+        if args.errors:
+            errors.close()
+    sys.stderr.write('\n' + json.dumps(stats) + '\n')
+
+
+if __name__ == '__main__':
+    main()
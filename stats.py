@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+import json
+from time import perf_counter
+
+
+class Stats:
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    def add(self, stage, seconds, size=0):
+        if stage not in self.stages:
+            self.stages[stage] = {'seconds': 0.0, 'calls': 0, 'bytes': 0}
+        entry = self.stages[stage]
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        entry['bytes'] += size
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def timed(self, stage, function, size=None):
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            result = function(*args, **kwargs)
+            self.add(stage, perf_counter() - start,
+                     size(args, result) if size else 0)
+            return result
+        return wrapper
+
+    @contextmanager
+    def timer(self, stage, size=0):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, perf_counter() - start, size)
+
+    def as_dict(self):
+        candidates = self.counters.get('sync candidates', 0)
+        frames = self.counters.get('frames', 0)
+        report = {'stages': self.stages, 'counters': dict(self.counters)}
+        if candidates:
+            rejected = max(candidates - frames, 0)
+            report['counters']['rejected candidates'] = rejected
+            report['false sync rate'] = rejected / candidates
+        return report
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
@@ -0,0 +1,120 @@
+from array import array
+import hashlib
+import math
+import random
+import sys
+from CRC8 import CRC8
+from CRC16 import CRC16
+import encoder
+crc8 = CRC8()
+crc16 = CRC16()
+
+
+def verbatim_frame(channels, number, variable, rate):
+    block_size = len(channels[0])
+    code, rate_data = encoder.rate_code(rate)
+    header = bytes([0xff, 0xf8 | variable, 0x70 | code,
+                    (len(channels) - 1) << 4 | 0x8]) + \
+        encoder.utf8_number(number) + \
+        (block_size - 1).to_bytes(2, byteorder='big') + rate_data
+    frame = bytearray(header + bytes([crc8.get_crc(header)]))
+    for channel in channels:
+        data = array('h', channel)
+        if sys.byteorder == 'little':
+            data.byteswap()
+        frame += b'\x02' + data.tobytes()
+    return frame + crc16.get_crc(frame).to_bytes(2, byteorder='big')
+
+
+def make_file(path, frames=10, variable=False, rate=44100, channels=2,
+              pictures=0, picture_size=1024, seekpoints=0, tracks=0,
+              seed=0):
+    generator = random.Random(seed)
+    block_sizes = [generator.randrange(256, 4097) if variable else 4096
+                   for _ in range(0, frames)]
+    md5 = hashlib.md5()
+    audio = bytearray()
+    offsets = []
+    sample = 0
+    for i, block_size in enumerate(block_sizes):
+        samples = [array('h', generator.getrandbits(16 * block_size)
+                         .to_bytes(2 * block_size, byteorder='little'))
+                   for _ in range(0, channels)]
+        interleaved = array('h', bytes(2 * block_size * channels))
+        for j, channel in enumerate(samples):
+            interleaved[j::channels] = channel
+        if sys.byteorder != 'little':
+            interleaved.byteswap()
+        md5.update(interleaved.tobytes())
+        offsets.append(len(audio))
+        audio += verbatim_frame(samples, sample if variable else i,
+                                variable, rate)
+        sample += block_size
+    frame_sizes = [end - begin for begin, end in
+                   zip(offsets, offsets[1:] + [len(audio)])]
+
+    blocks = [(0, (min(block_sizes) if variable else 4096).to_bytes(
+                  2, byteorder='big') +
+               max(block_sizes).to_bytes(2, byteorder='big') +
+               min(frame_sizes).to_bytes(3, byteorder='big') +
+               max(frame_sizes).to_bytes(3, byteorder='big') +
+               (rate << 44 | (channels - 1) << 41 | 15 << 36 | sample)
+               .to_bytes(8, byteorder='big') + md5.digest())]
+    if seekpoints:
+        points = b''
+        first = 0
+        for i in range(0, seekpoints):
+            if i < frames:
+                points += first.to_bytes(8, byteorder='big') + \
+                    offsets[i].to_bytes(8, byteorder='big') + \
+                    block_sizes[i].to_bytes(2, byteorder='big')
+                first += block_sizes[i]
+            else:
+                points += b'\xff' * 8 + bytes(10)
+        blocks.append((3, points))
+    comments = [b'TITLE=Benchmark', b'ARTIST=Generator']
+    blocks.append((4, len(b'benchmark').to_bytes(4, byteorder='little') +
+                   b'benchmark' + len(comments).to_bytes(4, byteorder='little')
+                   + b''.join(len(comment).to_bytes(4, byteorder='little') +
+                              comment for comment in comments)))
+    for i in range(0, pictures):
+        description = 'picture {0}'.format(i).encode()
+        blocks.append((6, (3).to_bytes(4, byteorder='big') +
+                       (9).to_bytes(4, byteorder='big') + b'image/png' +
+                       len(description).to_bytes(4, byteorder='big') +
+                       description +
+                       b''.join(value.to_bytes(4, byteorder='big')
+                                for value in (500, 500, 24, 0)) +
+                       picture_size.to_bytes(4, byteorder='big') +
+                       generator.getrandbits(8 * picture_size)
+                       .to_bytes(picture_size, byteorder='big')))
+    if tracks:
+        cuesheet = bytearray(b'0' * 13 + bytes(115))
+        cuesheet += (88200).to_bytes(8, byteorder='big') + b'\x80' + \
+            bytes(258) + bytes([tracks + 1])
+        for i in range(0, tracks):
+            cuesheet += (i * sample // tracks // 588 * 588).to_bytes(
+                8, byteorder='big') + bytes([i + 1]) + bytes(12) + bytes(14)
+            cuesheet += bytes([2]) + bytes(12) + \
+                (588).to_bytes(8, byteorder='big') + b'\x01' + bytes(3)
+        cuesheet += sample.to_bytes(8, byteorder='big') + bytes([170]) + \
+            bytes(27)
+        blocks.append((5, bytes(cuesheet)))
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        for i, (type_of_block, data) in enumerate(blocks):
+            f.write(encoder.metadata_block(type_of_block, data,
+                                           i == len(blocks) - 1))
+        f.write(audio)
+    return path
+
+
+def make_encoded_file(path, frames=10, rate=44100, seed=0):
+    generator = random.Random(seed)
+    total = frames * 4096
+    channels = [[int(8000 * math.sin(i * (0.01 + 0.002 * j)) +
+                     3000 * math.sin(i * 0.13)) +
+                 generator.randrange(-64, 65) for i in range(0, total)]
+                for j in range(0, 2)]
+    return encoder.encode(path, channels, rate, 16,
+                          tags={'TITLE': 'Benchmark'}, workers=1)
@@ -1,5 +1,28 @@
+import asyncio
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
 import unittest
+import wave
+from async_flac import open_flac
+from byte_source import FileSource, LocalRangeServer, RangeSource
+import benchmark
+from CRC8 import CRC8
+from CRC16 import CRC16
+import decoder
+import encoder
+from catalog import Catalog
 from flac import AudioFile
+from frame_cache import FrameCache
+from parallel import decode_parallel
+import playback
+import report
+from scanner import scan_file
+import synthetic
+import waveform
 
 
 class TestFlacParser(unittest.TestCase):
@@ -24,6 +47,40 @@ class TestFlacParser(unittest.TestCase):
         self.audio_file.parse_frames()
         self.assertEqual(len(self.audio_file.frames), self.number_of_frames)
 
+    def test_seek(self):
+        sample = self.audio_file.streaminfo['samples in flow'] // 2
+        frame = self.audio_file.seek(sample)
+        self.assertLessEqual(frame['first sample'], sample)
+        self.assertLess(sample, frame['first sample'] + frame['block size'])
+        self.audio_file.parse_frames()
+        self.assertEqual(self.audio_file.seek(sample), frame)
+
+    def test_iter_frames_from_stream(self):
+        with open(self.filename, 'rb') as f:
+            stream = AudioFile(f)
+            frames = stream.iter_frames(decode=True)
+            frame, samples = next(frames)
+            self.assertEqual(frame['offset'], stream.first_frame)
+            self.assertEqual(len(samples[0]), frame['block size'])
+            self.assertEqual(sum(1 for _ in frames) + 1,
+                             self.number_of_frames)
+
+    def test_trailing_tag(self):
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        tagged = data + b'TAG' + bytes(125)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.flac')
+            with open(path, 'wb') as f:
+                f.write(tagged)
+            with AudioFile(path) as file:
+                file.parse_frames()
+                self.assertEqual(file.frames.crc_failures(), [])
+                self.assertEqual(file.frames.end_offset, len(data))
+        report = AudioFile(io.BytesIO(tagged)).verify()
+        self.assertEqual(report['crc failures'], [])
+        self.assertEqual(report['frames'], self.number_of_frames)
+
     def test_text_making(self):
         self.assertGreater(len(self.audio_file.make_text()), 0)
 
@@ -33,3 +90,408 @@ class TestFlacParser(unittest.TestCase):
     def test_cuesheet(self):
         file = AudioFile(self.filename_with_cuesheet)
         self.assertGreater(len(file.cuesheet), 0)
+
+    def test_lazy_metadata(self):
+        file = AudioFile(self.filename_with_cuesheet, lazy=True)
+        self.assertEqual(file.streaminfo, AudioFile(
+            self.filename_with_cuesheet).streaminfo)
+        self.assertIs(file.cuesheet, file.cuesheet)
+        self.assertEqual(file.seektable, AudioFile(
+            self.filename_with_cuesheet).seektable)
+
+    def test_frame_index_queries(self):
+        self.audio_file.parse_frames()
+        frames = self.audio_file.frames
+        self.assertEqual(frames.frame_for_sample(0), 0)
+        self.assertEqual(frames.frame_at_offset(frames[5]['offset'] + 1), 5)
+        self.assertEqual(len(frames.bitrates(
+            self.audio_file.streaminfo['rate'])), self.number_of_frames)
+
+    def test_frame_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FrameCache(directory)
+            self.audio_file.parse_frames(cache)
+            cached = AudioFile(self.filename)
+            cached.parse_frames(cache)
+            self.assertEqual(list(cached.frames),
+                             list(self.audio_file.frames))
+            FrameCache(directory, max_size=0).evict()
+            self.assertEqual(os.listdir(directory), [])
+            blocked = os.path.join(directory, 'file')
+            open(blocked, 'w').close()
+            uncached = AudioFile(self.filename)
+            uncached.parse_frames(FrameCache(os.path.join(blocked, 'cache')))
+            self.assertEqual(len(uncached.frames), self.number_of_frames)
+        with open(self.filename, 'rb') as f:
+            stream = AudioFile(io.BytesIO(f.read()))
+        stream.parse_frames(FrameCache())
+        self.assertEqual(len(stream.frames), self.number_of_frames)
+
+    def test_decode_frame(self):
+        self.audio_file.parse_frames()
+        samples = self.audio_file.decode_frame(0)
+        self.assertEqual(len(samples), self.audio_file.streaminfo['channels'])
+        for channel in samples:
+            self.assertEqual(len(channel),
+                             self.audio_file.frames[0]['block size'])
+
+    def test_verify(self):
+        report = self.audio_file.verify()
+        self.assertEqual(report['frames'], self.number_of_frames)
+        self.assertEqual(report['crc failures'], [])
+        self.assertEqual(report['decode failures'], [])
+        self.assertEqual(report['samples'],
+                         self.audio_file.streaminfo['samples in flow'])
+        self.assertIn(report['md5 ok'], (True, None))
+
+    def test_decode_parallel(self):
+        file = AudioFile(self.filename_with_cuesheet)
+        self.assertEqual(decode_parallel(file, workers=2), file.decode())
+
+    def test_scan_file(self):
+        record, error = scan_file(self.filename_with_cuesheet)
+        self.assertIsNone(error)
+        self.assertEqual(record['streaminfo'],
+                         AudioFile(self.filename_with_cuesheet).streaminfo)
+        self.assertTrue(all('pic' not in picture
+                            for picture in record['pictures']))
+        record, error = scan_file('not flac.txt')
+        self.assertIsNone(record)
+        self.assertEqual(error['message'], 'file is not flac')
+
+    def test_catalog(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = shutil.copy(self.filename_with_cuesheet, directory)
+            with AudioFile(path) as file:
+                info = file.streaminfo
+            with Catalog(os.path.join(directory, 'catalog.db')) as catalog:
+                self.assertEqual(catalog.update([directory])['added'], 1)
+                self.assertEqual(catalog.update([directory])['unchanged'], 1)
+                rows = catalog.query(rate=info['rate'],
+                                     channels=info['channels'])
+                self.assertEqual([row['path'] for row in rows],
+                                 [os.path.abspath(path)])
+                os.remove(path)
+                self.assertEqual(catalog.update([directory])['deleted'], 1)
+                self.assertEqual(catalog.query(), [])
+
+    def test_open_flac_async(self):
+        file = asyncio.run(open_flac(self.filename_with_cuesheet))
+        expected = AudioFile(self.filename_with_cuesheet)
+        self.assertEqual(file.streaminfo, expected.streaminfo)
+        self.assertEqual(file.cuesheet, expected.cuesheet)
+        self.assertEqual(file.tags, expected.tags)
+        self.assertEqual(file.picture[0]['pic'], expected.picture[0]['pic'])
+        for frame_access in (file.parse_frames, file.verify,
+                             lambda: list(file.iter_frames()),
+                             lambda: file.seek(1000)):
+            with self.assertRaises(ValueError):
+                frame_access()
+
+    def test_range_source(self):
+        server = LocalRangeServer(self.filename_with_cuesheet)
+        source = RangeSource(server, server.size, block_size=4096)
+        file = AudioFile(source, lazy=True)
+        expected = AudioFile(self.filename_with_cuesheet)
+        self.assertEqual(file.cuesheet, expected.cuesheet)
+        self.assertLessEqual(source.bytes_read, file.first_frame + 16)
+        self.assertEqual(file.decode(), expected.decode())
+
+    def test_picture_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for i, picture in enumerate(self.audio_file.picture):
+                path = os.path.join(directory, str(i))
+                self.audio_file.save_picture(i, path)
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), picture['pic'])
+                self.assertEqual(len(picture['pic']), picture.length)
+        with AudioFile(self.filename) as file:
+            data = file.picture[0].data()
+            head = file.read_at(0, 4)
+        self.assertEqual(data, self.audio_file.picture[0]['pic'])
+        self.assertEqual(head, b'fLaC')
+
+    def test_frame_report(self):
+        file = AudioFile(self.filename_with_cuesheet)
+        file.parse_frames()
+        text = io.StringIO()
+        report.write_report(file, text, 'jsonl')
+        rows = [json.loads(line) for line in text.getvalue().splitlines()]
+        self.assertEqual([row['offset'] for row in rows],
+                         list(file.frames.offsets))
+        binary = io.BytesIO()
+        report.write_report(file, binary, 'binary')
+        binary.seek(0)
+        self.assertEqual([frame['sample number']
+                          for frame in report.read_binary(binary)],
+                         list(file.frames.numbers))
+        with self.assertRaises(ValueError):
+            list(report.read_binary(io.BytesIO(binary.getvalue()[:-1])))
+
+    def test_profile_stats(self):
+        file = AudioFile(self.filename, profile=True)
+        file.parse_frames()
+        report = file.stats.as_dict()
+        self.assertEqual(report['counters']['frames'], self.number_of_frames)
+        self.assertEqual(report['stages']['parse frames']['calls'], 1)
+        self.assertGreaterEqual(report['counters']['sync candidates'],
+                                self.number_of_frames)
+        self.assertIsNone(AudioFile(self.filename).stats)
+
+    def test_frames_pass_crc16(self):
+        self.audio_file.parse_frames()
+        self.assertEqual(self.audio_file.frames.crc_failures(), [])
+
+
+class TestSyntheticFiles(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def make_file(self, name='a.flac', **options):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return synthetic.make_file(path, **options)
+
+    def test_synthetic_corpus(self):
+        path = self.make_file(frames=20, variable=True, rate=22051,
+                              pictures=2, seekpoints=30, tracks=3)
+        with AudioFile(path) as file:
+            self.assertEqual(file.streaminfo['rate'], 22051)
+            self.assertEqual(len(file.picture), 2)
+            self.assertEqual(len(file.cuesheet['tracks']), 4)
+            self.assertEqual(file.verify()['md5 ok'], True)
+            self.assertEqual(file.verify()['frames'], 20)
+        self.assertEqual([encoder.rate_code(options['rate'])[0]
+                          for options in benchmark.corpus.values()
+                          if 'rate' in options], [12, 13, 14])
+        path = self.make_file('b.flac', frames=3, rate=100010)
+        with AudioFile(path) as file:
+            self.assertEqual(file.buffer[file.first_frame + 2] & 0xf, 14)
+            self.assertEqual(file.verify()['crc failures'], [])
+            self.assertEqual(file.verify()['frames'], 3)
+
+    def test_verify_stream(self):
+        with open(self.make_file(frames=5, variable=True), 'rb') as f:
+            data = f.read()
+        stream = AudioFile(io.BytesIO(data))
+        report = stream.verify()
+        self.assertEqual(report['frames'], 5)
+        self.assertEqual(report['md5 ok'], True)
+        self.assertEqual(report['crc failures'], [])
+        stream = AudioFile(io.BytesIO(data))
+        stream.parse_frames()
+        with self.assertRaises(ValueError):
+            stream.decode_frame(0)
+        with self.assertRaises(ValueError):
+            stream.verify()
+
+    def test_skip_ahead_scan(self):
+        with AudioFile(self.make_file(frames=20), profile=True) as file:
+            file.parse_frames()
+            counters = file.stats.as_dict()['counters']
+            self.assertEqual(len(file.frames), 20)
+            self.assertEqual(file.frames.crc_failures(), [])
+            self.assertGreater(counters['skipped bytes'], 0)
+            self.assertEqual(counters['sync candidates'], 20)
+
+    def test_wrong_frame_minsize(self):
+        path = self.make_file(frames=20, variable=True)
+        with AudioFile(path) as file:
+            file.parse_frames()
+            offsets = list(file.frames.offsets)
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        minsize = int.from_bytes(data[12:15], byteorder='big')
+        for wrong in (minsize + 1000, 2 * minsize + 1000, 1 << 23):
+            data[12:15] = min(wrong, (1 << 24) - 1).to_bytes(
+                3, byteorder='big')
+            with open(path, 'wb') as f:
+                f.write(data)
+            with AudioFile(path) as file:
+                file.parse_frames()
+                self.assertEqual(list(file.frames.offsets), offsets)
+                self.assertEqual(file.frames.crc_failures(), [])
+
+    def test_frame_header_codes(self):
+        def header(size_code, rate_code, number, extra):
+            data = bytes([0xff, 0xf9, size_code << 4 | rate_code, 0x18]) + \
+                encoder.utf8_number(number) + extra
+            return data + bytes([CRC8().get_crc(data)])
+        with AudioFile(self.make_file(frames=2, variable=True)) as file:
+            for size_code, rate_code, number, extra, expected in (
+                    (6, 9, 0, b'\xbf', (192, 44.1, 0)),
+                    (7, 9, 0, b'\x40\x00', (16385, 44.1, 0)),
+                    (12, 12, 5, b'\x30', (4096, 48, 5)),
+                    (12, 13, 5, b'\x93\xa8', (4096, 37.8, 5)),
+                    (12, 14, 5, b'\x27\x11', (4096, 100.01, 5)),
+                    (6, 14, (1 << 36) - 1, b'\x0f\x27\x11',
+                     (16, 100.01, (1 << 36) - 1))):
+                data = header(size_code, rate_code, number, extra)
+                parsed = file.parse_one_frame(data, 0, -1)
+                self.assertEqual((parsed[0], parsed[1], parsed[5]), expected)
+                self.assertEqual(parsed[4], len(data))
+        data = header(12, 9, (1 << 36) - 1, b'')
+        self.assertEqual(data[4], 0xfe)
+        self.assertEqual(len(data), 12)
+
+    def test_source_seek_reads_little(self):
+        path = self.make_file(frames=100)
+        expected = AudioFile(path)
+        source = FileSource(path)
+        file = AudioFile(source, lazy=True)
+        sample = file.streaminfo['samples in flow'] * 2 // 3
+        before = source.bytes_read
+        self.assertEqual(file.seek(sample), expected.seek(sample))
+        self.assertEqual(len(file.frames), 0)
+        self.assertLess(source.bytes_read - before,
+                        os.path.getsize(path) // 10)
+        source.close()
+
+    def test_decode_parallel_error(self):
+        path = self.make_file(frames=4)
+        with AudioFile(path) as file:
+            file.parse_frames()
+            offset = file.frames.offsets[2]
+            subframe = file.parse_one_frame(file.buffer, offset, -1)[4]
+        with open(path, 'r+b') as f:
+            f.seek(subframe)
+            f.write(b'\x04')
+        file = AudioFile(path)
+        with self.assertRaises(ValueError) as serial:
+            file.decode()
+        with self.assertRaises(ValueError) as parallel:
+            decode_parallel(file, workers=2)
+        self.assertEqual(str(parallel.exception), str(serial.exception))
+
+    def test_scan_export_names(self):
+        pictures = os.path.join(self.directory, 'pictures')
+        os.makedirs(pictures)
+        paths = [self.make_file(os.path.join(folder, 'cover.flac'), frames=1,
+                                pictures=1) for folder in ('a', 'b')]
+        files = [scan_file(path, pictures)[0]['pictures'][0]['file']
+                 for path in paths]
+        self.assertNotEqual(files[0], files[1])
+        self.assertEqual(len(os.listdir(pictures)), 2)
+
+    def test_encoder_round_trip(self):
+        channels = [[int(9000 * math.sin(i * 0.01 * (j + 1))) + i % 7
+                     for i in range(0, 10000)] for j in range(0, 2)]
+        path = encoder.encode(os.path.join(self.directory, 'a.flac'),
+                              channels, 44100, 16, block_size=1152,
+                              tags={'TITLE': 'Test'}, workers=1)
+        with AudioFile(path) as file:
+            file.parse_frames()
+            self.assertEqual(len(file.frames), 9)
+            self.assertEqual([list(channel) for channel in file.decode()],
+                             channels)
+            self.assertEqual(file.verify()['md5 ok'], True)
+            self.assertEqual(file.tags['TITLE'], {'Test'})
+
+    def test_encoder_rate_codes(self):
+        self.assertEqual(encoder.rate_code(44100), (9, b''))
+        self.assertEqual(encoder.rate_code(37800), (13, b'\x93\xa8'))
+        self.assertEqual(encoder.rate_code(100010), (14, b'\x27\x11'))
+        self.assertEqual(encoder.rate_code(100001), (0, b''))
+        self.assertEqual(encoder.rate_code(700000), (0, b''))
+        channels = [[i % 50 - 25 for i in range(0, 3000)]]
+        for rate in (100001, 700000):
+            path = encoder.encode(os.path.join(self.directory, 'a.flac'),
+                                  channels, rate, 16, block_size=1024,
+                                  workers=1)
+            with AudioFile(path) as file:
+                self.assertEqual(file.streaminfo['rate'], rate)
+                self.assertEqual(file.verify()['frames'], 3)
+                self.assertEqual(list(file.decode()[0]), channels[0])
+
+    def test_playback_pipeline(self):
+        output = os.path.join(self.directory, 'a.wav')
+        with AudioFile(self.make_file(frames=6, variable=True)) as file:
+            expected = decoder.to_bytes(file.decode(), 16)
+            pipeline = playback.Pipeline(file, playback.WavSink(output),
+                                         buffer_seconds=0.05)
+            pipeline.seek(5000)
+            pipeline.play()
+            self.assertTrue(pipeline.wait(10))
+            pipeline.stop()
+        with wave.open(output) as f:
+            data = f.readframes(f.getnframes())
+        self.assertEqual(data, expected[5000 * 4:])
+        self.assertEqual(pipeline.position, len(expected) // 4)
+        self.assertIsNotNone(pipeline.stats['startup latency'])
+        self.assertEqual(pipeline.stats['decode errors'], 0)
+
+    def test_playback_pull(self):
+        class PullSink:
+            volume = 1.0
+            start = stop = lambda *args: None
+        path = self.make_file(frames=6)
+        expected = decoder.to_bytes(AudioFile(path).decode(), 16)
+        pipeline = playback.Pipeline(path, PullSink(), buffer_seconds=0.05)
+        self.assertIsNone(pipeline.current)
+        pipeline.play()
+        data = []
+        while not pipeline.finished.is_set():
+            chunk, audio_format = pipeline.pull(4096)
+            if chunk:
+                data.append(chunk)
+                self.assertEqual(audio_format, (44100, 2, 16))
+            else:
+                pipeline.wait(0.001)
+        pipeline.close()
+        self.assertEqual(b''.join(data), expected)
+        self.assertEqual(pipeline.stats['frames decoded'], 6)
+        with open(path, 'rb') as f:
+            stream = AudioFile(io.BytesIO(f.read()))
+        pipeline = playback.Pipeline(stream, playback.NullSink())
+        pipeline.play()
+        self.assertTrue(pipeline.wait(10))
+        pipeline.close()
+        self.assertEqual(pipeline.stats['decode errors'], 6)
+        self.assertEqual(pipeline.stats['frames decoded'], 0)
+
+    def test_gapless_playlist(self):
+        paths = [self.make_file('{0}.flac'.format(i), frames=3 + i,
+                                variable=i == 1, seed=i)
+                 for i in range(0, 3)]
+        expected = b''.join(decoder.to_bytes(AudioFile(path).decode(), 16)
+                            for path in paths)
+        output = os.path.join(self.directory, 'a.wav')
+        pipeline = playback.Pipeline(
+            AudioFile(paths[0]), playback.WavSink(output),
+            buffer_seconds=0.05,
+            playlist=[paths[1], os.path.join(self.directory, 'missing.flac'),
+                      paths[2]])
+        pipeline.play()
+        self.assertTrue(pipeline.wait(10))
+        pipeline.close()
+        with wave.open(output) as f:
+            self.assertEqual(f.readframes(f.getnframes()), expected)
+        self.assertEqual(pipeline.track, 3)
+        self.assertEqual(pipeline.stats['failed tracks'], 1)
+
+    def test_waveform_peaks(self):
+        cache = waveform.PeakCache(os.path.join(self.directory, 'peaks'))
+        with AudioFile(self.make_file(frames=7, variable=True)) as file:
+            peaks = waveform.load_or_compute(file, cache, workers=2)
+            expected = waveform.bucket_peaks(file.decode(), 1024, 1.0)
+            self.assertEqual(peaks.levels[0], expected)
+            self.assertEqual(len(peaks.levels[-1][0]), 2)
+            self.assertEqual(len(peaks.columns(10)), 10)
+            cached = cache.load(file)
+            self.assertEqual(cached.levels, peaks.levels)
+
+
+class TestChecksums(unittest.TestCase):
+
+    def test_crc8_check_value(self):
+        self.assertEqual(CRC8().get_crc(b'123456789'), 0xf4)
+        self.assertEqual(CRC8().get_crcs(b'123456789', [(0, 9), (0, 3)]),
+                         [0xf4, CRC8().get_crc(b'123')])
+
+    def test_crc16_check_value(self):
+        self.assertEqual(CRC16().get_crc(b'123456789'), 0xfee8)
+        self.assertEqual(CRC16().get_crc(b'6789', CRC16().get_crc(b'12345')),
+                         0xfee8)
@@ -0,0 +1,269 @@
+from argparse import ArgumentParser
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import math
+from operator import mul
+import os
+import struct
+import sys
+from flac import AudioFile
+magic = b'FLPK'
+version = 1
+header = struct.Struct('<4sH16sQIB')
+bucket_size = 1024
+factor = 4
+
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'flacDecoder', 'peaks')
+
+
+class Peaks:
+    def __init__(self, total, bucket_size=bucket_size):
+        self.total = total
+        self.bucket_size = bucket_size
+        count = -(-total // bucket_size)
+        self.levels = [(array('h', bytes(2 * count)),
+                        array('h', bytes(2 * count)),
+                        array('H', bytes(2 * count)))]
+        self.computed = 0
+        self.complete = False
+
+    def __len__(self):
+        return len(self.levels[0][0])
+
+    def fill(self, first, mins, maxs, rms):
+        end = first + len(mins)
+        level = self.levels[0]
+        level[0][first:end] = mins
+        level[1][first:end] = maxs
+        level[2][first:end] = rms
+        self.computed += len(mins)
+
+    def build_levels(self):
+        del self.levels[1:]
+        mins, maxs, rms = self.levels[0]
+        while len(mins) > factor:
+            mins = array('h', [min(mins[i:i + factor])
+                               for i in range(0, len(mins), factor)])
+            maxs = array('h', [max(maxs[i:i + factor])
+                               for i in range(0, len(maxs), factor)])
+            rms = array('H', [round(math.sqrt(sum(map(mul, part, part)) /
+                                              len(part)))
+                              for part in (rms[i:i + factor] for i in
+                                           range(0, len(rms), factor))])
+            self.levels.append((mins, maxs, rms))
+        self.complete = True
+
+    def columns(self, width):
+        level = self.levels[0]
+        for candidate in self.levels:
+            if len(candidate[0]) >= width:
+                level = candidate
+        mins, maxs, rms = level
+        count = len(mins)
+        result = []
+        for x in range(0, min(width, count)):
+            begin = x * count // width
+            end = max((x + 1) * count // width, begin + 1)
+            part = rms[begin:end]
+            result.append((min(mins[begin:end]), max(maxs[begin:end]),
+                           round(math.sqrt(sum(map(mul, part, part)) /
+                                           len(part)))))
+        return result
+
+    def write(self, f):
+        for level in self.levels:
+            for column in level:
+                data = array(column.typecode, column)
+                if sys.byteorder == 'big':
+                    data.byteswap()
+                f.write(data.tobytes())
+
+    @classmethod
+    def read(cls, f, total, bucket_size, levels):
+        peaks = cls(total, bucket_size)
+        peaks.levels = []
+        count = -(-total // bucket_size)
+        for i in range(0, levels):
+            level = []
+            for typecode in ('h', 'h', 'H'):
+                column = array(typecode)
+                column.frombytes(f.read(2 * count))
+                if len(column) != count:
+                    raise EOFError()
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                level.append(column)
+            peaks.levels.append(tuple(level))
+            count = -(-count // factor)
+        peaks.computed = len(peaks)
+        peaks.complete = True
+        return peaks
+
+
+def total_samples(audio_file):
+    frames = audio_file.frames
+    if audio_file.streaminfo['samples in flow'] or not len(frames):
+        return audio_file.streaminfo['samples in flow']
+    return frames.first_samples[-1] + frames.block_sizes[-1]
+
+
+def scale(sample_size):
+    return 2.0 ** (16 - sample_size)
+
+
+def bucket_peaks(channels, size, ratio):
+    mins = array('h')
+    maxs = array('h')
+    rms = array('H')
+    for begin in range(0, len(channels[0]), size):
+        parts = [channel[begin:begin + size] for channel in channels]
+        mins.append(max(-32768, round(min(map(min, parts)) * ratio)))
+        maxs.append(min(32767, round(max(map(max, parts)) * ratio)))
+        squares = sum(sum(map(mul, part, part)) for part in parts)
+        rms.append(min(32767, round(math.sqrt(
+            squares / (len(parts) * len(parts[0]))) * ratio)))
+    return mins, maxs, rms
+
+
+def peaks_range(filename, first_bucket, last_bucket, size, total,
+                sample_size, offsets, ends, first_samples):
+    begin = first_bucket * size
+    end = min(last_bucket * size, total)
+    channels = None
+    with AudioFile(filename, lazy=True) as audio_file:
+        for offset, frame_end, first in zip(offsets, ends, first_samples):
+            samples, frame_end = audio_file.decode_frame_at(offset, frame_end)
+            if channels is None:
+                channels = [array('i') for _ in samples]
+            low = max(begin - first, 0)
+            high = max(min(end - first, len(samples[0])), 0)
+            for channel, channel_samples in zip(channels, samples):
+                channel.extend(channel_samples[low:high])
+    return (first_bucket,) + \
+        bucket_peaks(channels, size, scale(sample_size))
+
+
+def iter_peaks(audio_file, size=bucket_size, workers=None,
+               chunks_per_worker=4):
+    if not isinstance(audio_file.filename, str):
+        raise ValueError('peak overview needs a file on disk')
+    if not len(audio_file.frames):
+        audio_file.parse_frames()
+    frames = audio_file.frames
+    total = total_samples(audio_file)
+    if not total:
+        return
+    count = -(-total // size)
+    ends = array('q', frames.offsets[1:])
+    ends.append(frames.end_offset)
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, -(-count // (workers * chunks_per_worker)))
+    executor = ProcessPoolExecutor(workers)
+    futures = []
+    try:
+        for first_bucket in range(0, count, chunk):
+            last_bucket = min(first_bucket + chunk, count)
+            first = frames.frame_for_sample(first_bucket * size)
+            last = frames.frame_for_sample(
+                min(last_bucket * size, total) - 1) + 1
+            futures.append(executor.submit(
+                peaks_range, audio_file.filename, first_bucket, last_bucket,
+                size, total, audio_file.streaminfo['bits per sample'],
+                frames.offsets[first:last], ends[first:last],
+                frames.first_samples[first:last]))
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def compute(audio_file, peaks=None, size=bucket_size, workers=None,
+            cancelled=None):
+    if not len(audio_file.frames):
+        audio_file.parse_frames()
+    if peaks is None:
+        peaks = Peaks(total_samples(audio_file), size)
+    results = iter_peaks(audio_file, size, workers)
+    for first, mins, maxs, rms in results:
+        if cancelled and cancelled():
+            results.close()
+            return peaks
+        peaks.fill(first, mins, maxs, rms)
+    peaks.build_levels()
+    return peaks
+
+
+class PeakCache:
+    def __init__(self, directory=None):
+        self.directory = directory or default_directory()
+
+    def path(self, audio_file):
+        return os.path.join(self.directory, audio_file.md5.hex() + '.peaks')
+
+    def load(self, audio_file, size=bucket_size):
+        if not any(audio_file.md5):
+            return None
+        try:
+            with open(self.path(audio_file), 'rb') as f:
+                file_magic, file_version, md5, total, file_size, levels = \
+                    header.unpack(f.read(header.size))
+                if file_magic != magic or file_version != version or \
+                        md5 != audio_file.md5 or file_size != size or \
+                        total != audio_file.streaminfo['samples in flow']:
+                    return None
+                return Peaks.read(f, total, size, levels)
+        except (OSError, ValueError, EOFError, struct.error):
+            return None
+
+    def store(self, audio_file, peaks):
+        if not any(audio_file.md5) or not peaks.complete:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(audio_file)
+        temp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(header.pack(magic, version, audio_file.md5, peaks.total,
+                                peaks.bucket_size, len(peaks.levels)))
+            peaks.write(f)
+        os.replace(temp, path)
+
+
+def load_or_compute(audio_file, cache=None, peaks=None, workers=None,
+                    cancelled=None):
+    cache = cache or PeakCache()
+    cached = cache.load(audio_file)
+    if cached is not None:
+        return cached
+    peaks = compute(audio_file, peaks, workers=workers, cancelled=cancelled)
+    cache.store(audio_file, peaks)
+    return peaks
+
+
+def main():
+    parser = ArgumentParser(description='flac waveform overview',
+                            usage="""python waveform.py [files]
+        use flag -d --directory to choose the cache directory
+        use flag -j --jobs to set the number of worker processes""")
+    parser.add_argument('filenames', nargs='+', metavar='FILE',
+                        help='flac files to compute peaks for')
+    parser.add_argument('-d', '--directory', metavar='DIRECTORY',
+                        help='Peak cache directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes')
+    args = parser.parse_args()
+    cache = PeakCache(args.directory)
+    for filename in args.filenames:
+        with AudioFile(filename) as audio_file:
+            peaks = load_or_compute(audio_file, cache, workers=args.jobs)
+        sys.stderr.write('{0}: {1} buckets, {2} levels\n'.format(
+            filename, len(peaks), len(peaks.levels)))
+
+
+if __name__ == '__main__':
+    main()